@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+import sys, os
+import argparse
+import glob
+import gzip
+import json
+import time
+import shutil
+import tempfile
+import platform
+import resource
+import tracemalloc
+import numpy as np
+from hm_analysis_tool import get_molpdf
+from hm_analysis_tool import check_molpdf_conv
+from hm_analysis_tool import extract_str
+from hm_analysis_tool import compute_proqm
+
+SEED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test-case', 'glyt1')
+SCORE_PATTERN = 'MODELLER OBJECTIVE FUNCTION'
+#only the MODELLER models are seeds, the template has no REMARK header
+SEED_GLOB = 'glyt1.B*.pdb'
+#key of the machine and settings of a results/baseline file, it is not a benchmark
+SETTINGS_KEY = 'settings'
+
+def get_parser(args):
+    '''Define inputs by the user from the command line'''
+    ########## Input/output and options from user ###
+    parser = argparse.ArgumentParser(description = 'Benchmark the hm_analysis_tool stages on synthetic MODELLER ensembles made from the glyt1 test models')
+    parser.add_argument("-scales", help="comma separated number of models of the synthetic ensembles (default: 1000,10000,100000)", default='1000,10000,100000')
+    parser.add_argument("-natoms", help="keep only the first natoms coordinate lines of each model of the ensembles to bound the disk usage, 0 keeps the full models. The print_clean_pdb benchmark always uses the full models (default: 100)", default='100')
+    parser.add_argument("-gzip", help="also benchmark getscore on gzip compressed models", action='store_true')
+    parser.add_argument("-nproc", help="number of worker processes of getscore (default: 1)", default='1')
+    parser.add_argument("-nclean", help="number of models cleaned by the print_clean_pdb benchmark, run once on the first models of the largest ensemble (default: 1000)", default='1000')
+    parser.add_argument("-workdir", help="folder where the ensembles are written (default: a temporary folder that is removed)")
+    parser.add_argument("-o", dest="results", help="output json file with the results")
+    parser.add_argument("-baseline", help="json baseline file, the run fails if a benchmark is slower or uses more memory than allowed")
+    parser.add_argument("-save_baseline", help="write the results as the new baseline json file")
+    parser.add_argument("-max_slowdown", help="maximum time ratio to the baseline (default: 1.25)", default='1.25')
+    parser.add_argument("-max_memory", help="maximum peak memory ratio to the baseline (default: 1.25)", default='1.25')
+    return parser.parse_args(args)
+
+######### Functions ###############
+
+def read_seeds(seeddir,natoms=0):
+    '''Get the header and coordinate lines of the seed models, keeping the first natoms coordinate lines'''
+    seeds = []
+    for ifile in sorted(glob.glob(os.path.join(seeddir, SEED_GLOB))):
+        with open(ifile) as f:
+            lines = f.readlines()
+        header = [line for line in get_molpdf.header_lines(iter(lines))]
+        coords = lines[len(header):]
+        if natoms > 0:
+            coords = coords[:natoms] + ['END\n']
+        seeds.append((header, coords))
+    return seeds
+
+def make_ensemble(seeds,odir,nmdls,gz=False,seed=0):
+    '''Write nmdls synthetic models with random MODELLER objective function REMARKs, return the list of files'''
+    os.makedirs(odir, exist_ok=True)
+    scores = np.random.default_rng(seed).normal(2500, 150, nmdls)
+    files = []
+    for i in range(nmdls):
+        header, coords = seeds[i % len(seeds)]
+        lines = ['REMARK   6 MODELLER OBJECTIVE FUNCTION: %14.4f\n' % scores[i] if SCORE_PATTERN in line else line for line in header]
+        ifile = os.path.join(odir, 'synth.B%d.pdb' % (99990000 + i + 1))
+        if gz:
+            ifile += '.gz'
+            with gzip.open(ifile, 'wt') as f:
+                f.writelines(lines + coords)
+        else:
+            with open(ifile, 'w') as f:
+                f.writelines(lines + coords)
+        files.append(ifile)
+    return files
+
+def measure(run,setup=None,teardown=None):
+    '''Wall and cpu time of run and, in a second run, its peak of python memory in MB'''
+    results = {}
+    for memory in (False, True):
+        if setup is not None:
+            setup()
+        if memory:
+            tracemalloc.start()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        run()
+        if memory:
+            results['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0
+            tracemalloc.stop()
+        else:
+            results['time'] = time.perf_counter() - wall
+            results['cpu_time'] = time.process_time() - cpu
+        if teardown is not None:
+            teardown()
+    return results
+
+def bench_scale(seeds,workdir,nmdls,gz=False,nproc=1):
+    '''Run all the benchmarks that depend on the number of models on an ensemble of nmdls models'''
+    results = {}
+    mdldir = os.path.join(workdir, 'models_' + str(nmdls))
+    files = make_ensemble(seeds,mdldir,nmdls)
+    print('Benchmarking ' + str(nmdls) + ' models...')
+
+    results['getscore'] = measure(lambda: get_molpdf.getscore(files,SCORE_PATTERN,5,nproc))
+    if gz:
+        gzfiles = make_ensemble(seeds,os.path.join(workdir, 'models_gz_' + str(nmdls)),nmdls,gz=True)
+        results['getscore_gz'] = measure(lambda: get_molpdf.getscore(gzfiles,SCORE_PATTERN,5,nproc))
+        shutil.rmtree(os.path.dirname(gzfiles[0]))
+
+    scorefile = os.path.join(workdir, 'molpdf_' + str(nmdls) + '.txt')
+    np.savetxt(scorefile, get_molpdf.getscore(files,SCORE_PATTERN,5,nproc).values, fmt='%s')
+    win = max(1, min(200, nmdls // 5))
+    results['col2list_winrms'] = measure(lambda: check_molpdf_conv.winrms(-np.sort(-check_molpdf_conv.col2list(scorefile,1)),win))
+
+    cwd = os.getcwd()
+    outdir = 'best_' + str(nmdls)
+    def extract():
+        xtx_score, list_pdb = extract_str.get_best_perc(scorefile,10)
+        extract_str.create_outdir(outdir,list_pdb)
+    os.chdir(workdir)
+    try:
+        results['get_best_perc_create_outdir'] = measure(extract,teardown=lambda: shutil.rmtree(outdir))
+    finally:
+        os.chdir(cwd)
+
+    shutil.rmtree(mdldir)
+    return {name + '@' + str(nmdls): result for name, result in results.items()}
+
+def bench_clean(seeds,workdir,nclean):
+    '''Benchmark print_clean_pdb on nclean models, its cost per model does not depend on the ensemble size
+    but on the length of the models, so seeds should not be truncated'''
+    mdldir = os.path.join(workdir, 'models_clean')
+    toclean = make_ensemble(seeds,mdldir,nclean)
+    print('Benchmarking print_clean_pdb on ' + str(nclean) + ' models...')
+    result = measure(lambda: [compute_proqm.print_clean_pdb(pdb) for pdb in toclean],
+                     teardown=lambda: [os.remove(str(pdb) + 'cl') for pdb in toclean])
+    shutil.rmtree(mdldir)
+    return {'print_clean_pdb@' + str(nclean): result}
+
+def get_settings(args):
+    '''Machine and benchmark settings of a run, stored with the results'''
+    return {'machine': platform.machine(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'system': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__,
+            'scales': str(args.scales), 'natoms': int(args.natoms), 'nproc': int(args.nproc), 'nclean': int(args.nclean), 'gzip': args.gzip}
+
+def compare(results,baseline,max_slowdown,max_memory):
+    '''Get the list of benchmarks slower or using more memory than allowed by the baseline'''
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name == SETTINGS_KEY or name not in baseline:
+            continue
+        if result['time'] > baseline[name]['time'] * max_slowdown:
+            regressions.append('%s: %.3f s, baseline %.3f s' % (name, result['time'], baseline[name]['time']))
+        if result['peak_mb'] > baseline[name]['peak_mb'] * max_memory:
+            regressions.append('%s: %.1f MB, baseline %.1f MB' % (name, result['peak_mb'], baseline[name]['peak_mb']))
+    return regressions
+
+def main():
+    '''Main entry point'''
+    args = get_parser(sys.argv[1:])
+    ########### Variables ###############
+    scales = [int(scale) for scale in str(args.scales).split(',')]
+    natoms = int(args.natoms)
+    nproc = int(args.nproc)
+    nclean = int(args.nclean)
+    max_slowdown = float(args.max_slowdown)
+    max_memory = float(args.max_memory)
+    #####################################
+
+    if args.workdir != None:
+        workdir = os.path.abspath(str(args.workdir))
+        os.makedirs(workdir, exist_ok=True)
+    else:
+        workdir = tempfile.mkdtemp(prefix='hm_bench_')
+    try:
+        seeds = read_seeds(SEED_DIR,natoms)
+        results = {}
+        for nmdls in scales:
+            results.update(bench_scale(seeds,workdir,nmdls,args.gzip,nproc))
+        if nclean > 0:
+            results.update(bench_clean(read_seeds(SEED_DIR),workdir,nclean))
+    finally:
+        if args.workdir == None:
+            shutil.rmtree(workdir)
+
+    for name, result in sorted(results.items()):
+        print('%-40s %10.3f s %10.3f s cpu %10.1f MB' % (name, result['time'], result['cpu_time'], result['peak_mb']))
+    print('Peak RSS of the benchmark process: %.1f MB' % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+
+    output = dict(results, **{SETTINGS_KEY: get_settings(args)})
+    if args.results != None:
+        with open(str(args.results), 'w') as f:
+            json.dump(output, f, indent=1, sort_keys=True)
+    if args.save_baseline != None:
+        with open(str(args.save_baseline), 'w') as f:
+            json.dump(output, f, indent=1, sort_keys=True)
+    if args.baseline != None:
+        with open(str(args.baseline)) as f:
+            baseline = json.load(f)
+        if SETTINGS_KEY in baseline:
+            print('Baseline measured on ' + ', '.join('%s: %s' % item for item in sorted(baseline[SETTINGS_KEY].items())))
+        regressions = compare(results,baseline,max_slowdown,max_memory)
+        if len(regressions) > 0:
+            print('Performance regressions:\n' + '\n'.join(regressions))
+            sys.exit(1)
+        print('No performance regressions against ' + str(args.baseline))
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,11 @@
 __version__ = '0.1.0'
+from hm_analysis_tool import errors
+from hm_analysis_tool import score_io
 from hm_analysis_tool import get_molpdf
 from hm_analysis_tool import check_molpdf_conv
 from hm_analysis_tool import extract_str
-from hm_analysis_tool import compute_proqm 
+from hm_analysis_tool import profile_cache
+from hm_analysis_tool import compute_proqm
+from hm_analysis_tool import proqm_local
+from hm_analysis_tool import cluster_str
+from hm_analysis_tool import pipeline
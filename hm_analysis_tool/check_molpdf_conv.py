@@ -2,21 +2,44 @@
 import argparse
 import numpy as np
 import sys
-from matplotlib import pyplot as plt
+import glob
+import time
+import pandas as pd
+from hm_analysis_tool import score_io
+from hm_analysis_tool import get_molpdf
+from hm_analysis_tool import metrics
+from hm_analysis_tool.errors import HMAnalysisError, exit_on_error
+
+#exit status of -watch when the scores did not converge before new models stopped arriving
+NOT_CONVERGED_STATUS = 2
 
 def get_parser(args):
     parser = argparse.ArgumentParser(description = 'Script that plots MOLPDF scores to evaluate convergence. WARNING: all outputs will be rewritten!')
-    parser.add_argument("-scorefile", help="score input file (i.e format pdbfile score")
+    parser.add_argument("-scorefile", help="score input file (i.e format pdbfile score), text or binary .npy")
     parser.add_argument("-outrms" , help="name of output score RMSD")
     parser.add_argument("-ofig", help="name of the output pdf figure")
-    parser.add_argument("-win", help="windows size for computing score RMSD (default: 200)", default='200')
+    parser.add_argument("-win", help="windows size for computing score RMSD, a comma separated list computes one RMSD column per window (default: 200)", default='200')
     parser.add_argument("-scorecol", help="column index in score file (default: 1)", default='1')
+    parser.add_argument("-maxpoints", help="maximum number of points plotted per curve, longer curves are downsampled keeping the min/max of each bucket (default: 2000)", default='2000')
+    parser.add_argument("-no-plot", "--no-plot", help="do not plot the figure (matplotlib is not loaded)", dest="noplot", action='store_true')
+    parser.add_argument("-watch", "--watch", help="follow a growing score file (or -pdbdir) and stop when the score RMSD converges", action='store_true')
+    parser.add_argument("-pdbdir", help="with -watch, follow the pdb files in this directory instead of the score file")
+    parser.add_argument("-rootname", help="with -pdbdir, rootname of the pdb files (i.e. gly1.B)", dest="rootnm", default='')
+    parser.add_argument("-pattern", help="with -pdbdir, pattern in pdb file to search for score, (default='MODELLER OBJECTIVE FUNCTION')", default='MODELLER OBJECTIVE FUNCTION')
+    parser.add_argument("-col", help="with -pdbdir, column of MOLPDF score value in matched line of pdb (default=5)", default='5')
+    parser.add_argument("-tol", help="with -watch, relative change of the last score RMSD below which the scores are converged (default: 0.001)", default='0.001')
+    parser.add_argument("-interval", help="with -watch, seconds between checks for new models (default: 60)", default='60')
+    parser.add_argument("-max_idle", help="with -watch, number of checks in a row without new models after which it stops as not converged with exit status 2, 0 waits forever (default: 10)", default='10')
+    metrics.add_arguments(parser)
     return parser.parse_args(args)
 
 ######### Functions ###############
 
 def col2list(datfile, col):
     '''Extract the column #col of datfile and write it as a list'''
+    if score_io.is_binary(datfile):
+        return score_io.read_column(datfile, col)
+    metrics.count_files()
     collist = []
     with open(datfile,'r') as f:
         for line in f:
@@ -26,43 +49,181 @@ def col2list(datfile, col):
                 collist.append(line.strip().split()[col])
             except IndexError:
                 print('empty line')
-    collist = np.array(collist).astype(np.float)
+    collist = np.array(collist).astype(float)
     return collist
 
-def winrms(a, window_size):
+def cumsum_squares(a):
+    '''Cumulative sum of the squared values with a leading zero'''
+    return np.concatenate(([0.0], np.cumsum(np.power(np.asarray(a, dtype=np.float64),2))))
+
+def winrms(a, window_size, csum=None):
     '''Computes windows rms of a list of values'''
-    a2 = np.power(a,2)
-    window = np.ones(window_size)/float(window_size)
-    return np.sqrt(np.convolve(a2, window, 'valid'))
+    if csum is None:
+        csum = cumsum_squares(a)
+    msq = (csum[window_size:] - csum[:-window_size])/float(window_size)
+    return np.sqrt(np.maximum(msq, 0.0))
+
+def winrms_multi(a, windows):
+    '''Computes the windows rms of a list of values for several window sizes'''
+    csum = cumsum_squares(a)
+    return [winrms(a, window_size, csum) for window_size in windows]
+
+def parse_windows(win):
+    '''Get the list of window sizes from a comma separated string'''
+    return [int(window_size) for window_size in str(win).split(',')]
+
+def rms_columns(rmslist):
+    '''Stack the rms curves as columns, shorter curves are padded with nan'''
+    columns = np.full((max(len(rms) for rms in rmslist), len(rmslist)), np.nan)
+    for i, rms in enumerate(rmslist):
+        columns[:len(rms), i] = rms
+    return columns
+
+def enough_mdls(ilist,win):
+    '''check if the number of scored models is at least win*5'''
+    return len(ilist) >= win*5
 
 def check_numdls(ilist,win):
     '''check if the number of scored models in scorefile is at least more than win*5'''
     nummdls=(len(ilist))
-    if nummdls < win*5:
-        print('The total number of models, ' + str(nummdls) + ', is too little compared with the RMSD windows size,' + str(win) + '.')
-        print('Please, increase the number of models to analyze, or decrease the windows size.')
-        print('Exiting now...')
-        sys.exit()    
+    if not enough_mdls(ilist,win):
+        raise HMAnalysisError('The total number of models, ' + str(nummdls) + ', is too little compared with the RMSD windows size,' + str(win) + '.\n' +
+                              'Please, increase the number of models to analyze, or decrease the windows size.\n' +
+                              'Exiting now...')
+
+class ConvergenceWatch:
+    '''Keep the sorted scores and their windows rms up to date while new models arrive'''
+    def __init__(self, windows, tol):
+        self.windows = windows
+        self.tol = tol
+        self.scorelist = np.empty(0)
+        self.sortscorelist = np.empty(0)
+        self.csum = np.zeros(1)
+        self.rmslist = [np.empty(0) for win in windows]
+        self.change = [np.inf for win in windows]
+
+    def add(self, values):
+        '''Insert new scores in the sorted list and update only the affected windows'''
+        new = -np.sort(-np.asarray(values, dtype=np.float64))
+        if len(new) == 0:
+            return
+        self.scorelist = np.concatenate((self.scorelist, np.asarray(values, dtype=np.float64)))
+        pos = np.searchsorted(-self.sortscorelist, -new, side='right')
+        self.sortscorelist = np.insert(self.sortscorelist, pos, new)
+        #the squared sums before the first inserted score do not change
+        start = int(pos[0])
+        self.csum = np.concatenate((self.csum[:start+1], self.csum[start] + np.cumsum(np.power(self.sortscorelist[start:],2))))
+        for i, win in enumerate(self.windows):
+            if len(self.sortscorelist) < win:
+                continue
+            previous = self.rmslist[i]
+            keep = min(max(0, start - win + 1), len(previous))
+            msq = (self.csum[keep+win:] - self.csum[keep:-win])/float(win)
+            self.rmslist[i] = np.concatenate((previous[:keep], np.sqrt(np.maximum(msq, 0.0))))
+            if len(previous) > 0:
+                diff = abs(self.rmslist[i][-1] - previous[-1])
+                #a zero rms (identical scores) is converged only if it does not change
+                self.change[i] = diff/previous[-1] if previous[-1] > 0 else (0.0 if diff == 0 else np.inf)
 
-def plot_opt(ilist,slist,scorerms,ofig,win):
+    def converged(self):
+        '''check if there are enough models and the last rms of every window changed less than tol'''
+        return enough_mdls(self.scorelist, max(self.windows)) and all(change < self.tol for change in self.change)
+
+def poll_scorefile(scorefile,col,seen):
+    '''Get the scores of the models in scorefile that are not in seen'''
+    try:
+        df = score_io.read_scores(scorefile, names=None)
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return []
+    df = df[~df.iloc[:,0].isin(seen)].dropna()
+    seen.update(df.iloc[:,0])
+    return df.iloc[:,col].astype(float).tolist()
+
+def poll_pdbdir(pdbdir,rootnm,pattern,col,seen):
+    '''Get the scores of the pdb files in pdbdir that are not in seen'''
+    values = []
+    for ifile in sorted(set(glob.glob(pdbdir + '/' + str(rootnm) + '*.pdb')) - seen):
+        matches = get_molpdf.scan_file(ifile,pattern,col)
+        #files still being written have no score yet, they are checked again later
+        if len(matches) > 0:
+            seen.add(ifile)
+            values.extend(float(value) for name, value in matches)
+    return values
+
+def watch(poll,windows,tol,interval,rmsscorefile=None,max_idle=0):
+    '''Update the convergence with the new models from poll until the score RMSD converges,
+    or until max_idle checks in a row find no new models (if max_idle > 0)'''
+    conv = ConvergenceWatch(windows,tol)
+    idle = 0
+    while True:
+        values = poll()
+        if len(values) > 0:
+            idle = 0
+            if len(conv.scorelist) == 0 and len(values) > max(windows):
+                #the first models are added in two steps, so an ensemble that is already complete gets a change of the rms
+                conv.add(values[:-max(windows)])
+                values = values[-max(windows):]
+            conv.add(values)
+            if rmsscorefile is not None:
+                with open(rmsscorefile, 'w+') as datafile_id:
+                    np.savetxt(datafile_id, rms_columns(conv.rmslist), fmt='%1.4f')
+            print(str(len(conv.scorelist)) + ' models, relative change of the last score RMSD: ' + ', '.join('%.6f' % change for change in conv.change))
+            if conv.converged():
+                print('CONVERGED: the score RMSD changed less than ' + str(tol) + ' with ' + str(len(conv.scorelist)) + ' models')
+                return conv
+        else:
+            idle += 1
+            if max_idle > 0 and idle >= max_idle:
+                print('NOT CONVERGED: no new models in ' + str(idle) + ' checks, the score RMSD did not change less than ' + str(tol) + ' with ' + str(len(conv.scorelist)) + ' models')
+                return conv
+        time.sleep(interval)
+
+def minmax_downsample(a, maxpoints):
+    '''Get the indices and values of the min and max of each bucket of a, keeping the shape of the curve'''
+    a = np.asarray(a)
+    if len(a) <= maxpoints:
+        return np.arange(len(a)), a
+    edges = np.linspace(0, len(a), maxpoints//2 + 1).astype(int)
+    idx = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        bucket = a[start:end]
+        idx.extend(sorted({start + int(np.argmin(bucket)), start + int(np.argmax(bucket))}))
+    idx = np.array(idx)
+    return idx, a[idx]
+
+def load_pyplot():
+    '''Import pyplot with a non-interactive backend'''
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    return plt
+
+def plot_opt(ilist,slist,rmslist,ofig,windows,maxpoints=2000):
+    plt = load_pyplot()
     fig = plt.figure(figsize=(6,10))
     axis1 = fig.add_subplot(311)
-    axis1.plot(ilist)
+    axis1.plot(*minmax_downsample(ilist,maxpoints))
     axis1.set_ylabel('MOLPDF score (a.u)')
     axis1.set_xlabel('# of models')
     axis2 = fig.add_subplot(312)
-    axis2.plot(slist)
+    axis2.plot(*minmax_downsample(slist,maxpoints))
     axis2.set_ylabel('MOLPDF score (a.u.)')
     axis2.set_xlabel('# of models')
     axis3 = fig.add_subplot(313)
-    axis3.plot(scorerms)
+    for scorerms, win in zip(rmslist, windows):
+        axis3.plot(*minmax_downsample(scorerms,maxpoints), label=str(win) + ' models/window')
     axis3.set_ylabel('RMSD of MOLPDF score (a.u)')
-    axis3.set_xlabel('# of windows of (' + str(win) + ' models/window)')
+    axis3.set_xlabel('# of windows of (' + ', '.join(str(win) for win in windows) + ' models/window)')
+    if len(windows) > 1:
+        axis3.legend()
     fig.savefig(ofig)
+    plt.close(fig)
 
+@exit_on_error
 def main():
     '''Main entry point'''
     args = get_parser(sys.argv[1:])
+    metrics.setup(args,'check_molpdf_conv')
     ########### Variables ###############
     # Input files/directories
     scorefile = str(args.scorefile)
@@ -70,24 +231,47 @@ def main():
     rmsscorefile= str(args.outrms)
     figscoreconv= str(args.ofig)
     # Global variables
-    win = int(args.win)
+    windows = parse_windows(args.win)
     score_col = int(args.scorecol)
+    maxpoints = int(args.maxpoints)
+    noplot = args.noplot
     ####################################
 
-    scorelist = col2list(scorefile,score_col)
-    sortscorelist=-np.sort(-scorelist)
-    scorerms = winrms(sortscorelist,win)
+    if args.watch:
+        seen = set()
+        if args.pdbdir != None:
+            pdbdir = str(args.pdbdir)
+            poll = lambda: poll_pdbdir(pdbdir,str(args.rootnm),str(args.pattern),int(args.col),seen)
+        else:
+            poll = lambda: poll_scorefile(scorefile,score_col,seen)
+        with metrics.stage('watch'):
+            conv = watch(poll,windows,float(args.tol),float(args.interval),rmsscorefile,int(args.max_idle))
+        if not noplot and len(conv.scorelist) > 0:
+            with metrics.stage('plot'):
+                plot_opt(conv.scorelist,conv.sortscorelist,conv.rmslist,figscoreconv,windows,maxpoints)
+        if not conv.converged():
+            #job scripts tell a converged run (status 0) from one that stopped without converging
+            sys.exit(NOT_CONVERGED_STATUS)
+        return
+
+    with metrics.stage('col2list'):
+        scorelist = col2list(scorefile,score_col)
+    with metrics.stage('winrms'):
+        sortscorelist=-np.sort(-scorelist)
+        rmslist = winrms_multi(sortscorelist,windows)
 
     ### check if the number of scored models in scorefile is at least more than win*5
-    check_numdls(scorelist,win)
+    check_numdls(scorelist,max(windows))
         
     #plot results into file
-    plot_opt(scorelist,sortscorelist,scorerms,figscoreconv,win)
+    if not noplot:
+        with metrics.stage('plot'):
+            plot_opt(scorelist,sortscorelist,rmslist,figscoreconv,windows,maxpoints)
 
-    #transpose to make it readable and print with format
-    transp_rms = scorerms.T
-    with open(rmsscorefile, 'w+') as datafile_id:
-        np.savetxt(datafile_id, transp_rms, fmt=['%1.4f'])
+    #one column per window size, print with format
+    with metrics.stage('write_rms'):
+        with open(rmsscorefile, 'w+') as datafile_id:
+            np.savetxt(datafile_id, rms_columns(rmslist), fmt='%1.4f')
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+import sys, os
+import argparse
+import json
+import concurrent.futures
+import numpy as np
+from hm_analysis_tool import get_molpdf
+from hm_analysis_tool import metrics
+from hm_analysis_tool.errors import HMAnalysisError, exit_on_error
+
+#extensions of the coordinate store written next to the output folder of extract_str
+STORE_EXT = '.coords.npy'
+STORE_INFO_EXT = '.coords.json'
+
+def get_parser(args):
+    '''Define inputs by the user from the command line'''
+    ########## Input/output and options from user ###
+    parser = argparse.ArgumentParser(description = 'Script to compute the all-pairs RMSD of the models extracted by extract_str and cluster them. The coordinates are read once and cached next to the output folder')
+    parser.add_argument("-outdir", help="folder with the extracted pdb files", required=True)
+    parser.add_argument("-rootname", help="specify rootname of the pdb files (i.e. gly1.B, default: all the pdb files)", dest="rootnm", default='')
+    parser.add_argument("-atoms", help="comma separated atom names used for the superposition and the RMSD (default: CA)", default='CA')
+    parser.add_argument("-cutoff", help="RMSD cutoff in Angstrom of the clusters (default: 2.0)", default='2.0')
+    parser.add_argument("-nproc", help="number of worker processes used to read the pdb files and compute the RMSD (default=1)", default='1')
+    parser.add_argument("-batch", help="number of models superposed at once (default: 1024)", default='1024')
+    parser.add_argument("-o", dest="clusterfile", help="output file with the cluster of each model (default: clusters.txt)", default='clusters.txt')
+    parser.add_argument("-ormsd", help="optional output RMSD matrix, binary .npy file")
+    metrics.add_arguments(parser)
+    return parser.parse_args(args)
+
+######### Functions ###############
+def read_atoms(ifile):
+    '''Get the chain, residue number and name of the ATOM records of a pdb file and their coordinates'''
+    atoms = []
+    coords = []
+    metrics.count_files()
+    with get_molpdf.open_pdb(ifile) as f:
+        for line in f:
+            if line.startswith('ATOM'):
+                atoms.append(line[21] + ':' + line[22:27].strip() + ':' + line[12:16].strip())
+                coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    return atoms, np.array(coords, dtype=np.float32)
+
+def store_paths(outdir):
+    '''Get the coordinate store and its info file next to the output folder'''
+    root = os.path.normpath(outdir)
+    return root + STORE_EXT, root + STORE_INFO_EXT
+
+def file_stats(listfiles):
+    '''Get the name, size and modification time of a list of files'''
+    stats = get_molpdf.get_filestats(listfiles)
+    return [[str(row.col1), int(row.size), int(row.mtime)] for row in stats.itertuples()]
+
+def build_store(listfiles,storefile,nproc=1):
+    '''Read the ATOM records of the pdb files into a memory-mapped models x atoms x 3 array, return the atoms'''
+    if nproc > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as executor:
+            results = executor.map(read_atoms, listfiles, chunksize=max(1, len(listfiles) // (nproc * 4)))
+            atoms, coords = next(results)
+            store = np.lib.format.open_memmap(storefile, mode='w+', dtype=np.float32, shape=(len(listfiles), len(atoms), 3))
+            store[0] = coords
+            for i, (mdl_atoms, coords) in enumerate(results, 1):
+                if mdl_atoms != atoms:
+                    raise HMAnalysisError('The atoms of ' + str(listfiles[i]) + ' are not the same as the atoms of ' + str(listfiles[0]))
+                store[i] = coords
+        #the files read by the worker processes are not counted in this process
+        metrics.count_files(len(listfiles))
+    else:
+        atoms, coords = read_atoms(listfiles[0])
+        store = np.lib.format.open_memmap(storefile, mode='w+', dtype=np.float32, shape=(len(listfiles), len(atoms), 3))
+        store[0] = coords
+        for i in range(1, len(listfiles)):
+            mdl_atoms, coords = read_atoms(listfiles[i])
+            if mdl_atoms != atoms:
+                raise HMAnalysisError('The atoms of ' + str(listfiles[i]) + ' are not the same as the atoms of ' + str(listfiles[0]))
+            store[i] = coords
+    store.flush()
+    return atoms
+
+def load_store(outdir,listfiles,nproc=1):
+    '''Memory-map the coordinate store of the pdb files, it is (re)built if the files changed since it was written'''
+    storefile, infofile = store_paths(outdir)
+    stats = file_stats(listfiles)
+    try:
+        with open(infofile) as f:
+            info = json.load(f)
+    except (FileNotFoundError, ValueError):
+        info = None
+    if info is None or info['files'] != stats or not os.path.isfile(storefile):
+        print('Reading the coordinates of ' + str(len(listfiles)) + ' pdb files into ' + storefile)
+        atoms = build_store(listfiles,storefile,nproc)
+        info = {'files': stats, 'atoms': atoms}
+        with open(infofile, 'w') as f:
+            json.dump(info, f)
+    return np.load(storefile, mmap_mode='r'), info['atoms']
+
+def atom_indices(atoms,names):
+    '''Get the index of the atoms with one of the given names'''
+    indices = [i for i, atom in enumerate(atoms) if atom.split(':')[-1] in names]
+    if len(indices) == 0:
+        raise HMAnalysisError('There are no ' + ','.join(names) + ' atoms in the pdb files')
+    return np.array(indices)
+
+def center(coords):
+    '''Translate each model to its geometric center, as float64'''
+    coords = np.asarray(coords, dtype=np.float64)
+    return coords - coords.mean(axis=-2, keepdims=True)
+
+def superposed_rmsd(ref,mobile,sqnorm=None):
+    '''RMSD after the optimal superposition (Kabsch) of a centered model onto a batch of centered models,
+    sqnorm is the sum of the squared coordinates of each model of the batch'''
+    cov = np.matmul(ref.T, mobile)
+    s = np.linalg.svd(cov, compute_uv=False)
+    #reflections are not allowed, the smallest singular value changes sign
+    s[:, -1] *= np.sign(np.linalg.det(cov))
+    if sqnorm is None:
+        sqnorm = np.einsum('bnd,bnd->b', mobile, mobile)
+    return np.sqrt(np.maximum((ref * ref).sum() + sqnorm - 2 * s.sum(axis=1), 0) / ref.shape[0])
+
+def center_store(storefile,indices,centerfile=None,batch=1024):
+    '''Centered coordinates of the selected atoms of the coordinate store, computed once.
+    If centerfile is given they are written there memory-mapped, to be shared by the worker processes'''
+    store = np.load(storefile, mmap_mode='r')
+    shape = (store.shape[0], len(indices), 3)
+    if centerfile is not None:
+        coords = np.lib.format.open_memmap(centerfile, mode='w+', dtype=np.float64, shape=shape)
+    else:
+        coords = np.empty(shape)
+    for start in range(0, shape[0], batch):
+        coords[start:start + batch] = center(store[start:start + batch][:, indices])
+    if centerfile is not None:
+        coords.flush()
+    return coords
+
+def rmsd_rows(coords,sqnorm,rows,batch=1024):
+    '''RMSD of each model in rows to the models after it, coords are the centered coordinates or their .npy file'''
+    if isinstance(coords, str):
+        coords = np.load(coords, mmap_mode='r')
+    results = []
+    for i in rows:
+        ref = np.asarray(coords[i])
+        values = [superposed_rmsd(ref, coords[j:j + batch], sqnorm[j:j + batch]) for j in range(i + 1, len(coords), batch)]
+        results.append((i, np.concatenate(values) if len(values) > 0 else np.empty(0)))
+    return results
+
+def rmsd_matrix(storefile,indices,nproc=1,batch=1024):
+    '''All-pairs RMSD matrix of the models in the coordinate store'''
+    nmdls = np.load(storefile, mmap_mode='r').shape[0]
+    matrix = np.zeros((nmdls, nmdls))
+    if nproc > 1:
+        #the worker processes share the centered coordinates through a memory-mapped file instead of a copy each
+        centerfile = storefile[:-len('.npy')] + '.centered' + str(os.getpid()) + '.npy'
+        coords = None
+        try:
+            coords = center_store(storefile,indices,centerfile,batch)
+            sqnorm = np.einsum('bnd,bnd->b', coords, coords)
+            #interleaved rows balance the work, the first rows have the most pairs
+            blocks = [list(range(start, nmdls, nproc * 4)) for start in range(nproc * 4)]
+            with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as executor:
+                results = executor.map(rmsd_rows, [centerfile] * len(blocks), [sqnorm] * len(blocks), blocks, [batch] * len(blocks))
+                rows = [row for block in results for row in block]
+        finally:
+            #the memory map is closed before its file is removed
+            coords = None
+            if os.path.isfile(centerfile):
+                os.remove(centerfile)
+    else:
+        coords = center_store(storefile,indices,batch=batch)
+        sqnorm = np.einsum('bnd,bnd->b', coords, coords)
+        rows = rmsd_rows(coords,sqnorm,range(nmdls),batch)
+    for i, values in rows:
+        matrix[i, i + 1:] = values
+        matrix[i + 1:, i] = values
+    return matrix
+
+def cluster_rmsd(matrix,cutoff):
+    '''Cluster the models: the model with the most neighbours within cutoff and its neighbours form a cluster, repeated with the models left.
+    Return the cluster of each model and the center of each cluster'''
+    neighbours = matrix <= cutoff
+    counts = neighbours.sum(axis=1)
+    labels = np.full(len(matrix), -1)
+    centers = []
+    while (labels < 0).any():
+        mdl = int(np.argmax(np.where(labels < 0, counts, -1)))
+        members = np.flatnonzero(neighbours[mdl] & (labels < 0))
+        labels[members] = len(centers)
+        centers.append(mdl)
+        counts -= neighbours[:, members].sum(axis=1)
+    return labels, centers
+
+def print_clusters(ofile,listfiles,labels,centers):
+    '''Print the cluster of each model, the cluster centers are marked with 1'''
+    iscenter = np.zeros(len(listfiles), dtype=int)
+    iscenter[centers] = 1
+    with open(ofile, 'w') as f:
+        f.write('#pdbname cluster center\n')
+        for ifile, label, flag in zip(listfiles, labels, iscenter):
+            f.write('%s %d %d\n' % (ifile, label, flag))
+
+@exit_on_error
+def main():
+    '''Main entry point'''
+    args = get_parser(sys.argv[1:])
+    metrics.setup(args,'cluster_str')
+    ########### Variables ###############
+    outdir = str(args.outdir)
+    rootnm = str(args.rootnm)
+    names = str(args.atoms).split(',')
+    cutoff = float(args.cutoff)
+    nproc = int(args.nproc)
+    batch = int(args.batch)
+    clusterfile = str(args.clusterfile)
+    #####################################
+
+    with metrics.stage('list_files'):
+        pdblist = sorted(get_molpdf.get_listoffiles(outdir,rootnm))
+    with metrics.stage('load_store'):
+        coords, atoms = load_store(outdir,pdblist,nproc)
+    indices = atom_indices(atoms,names)
+    with metrics.stage('rmsd_matrix'):
+        matrix = rmsd_matrix(store_paths(outdir)[0],indices,nproc,batch)
+    if args.ormsd != None:
+        np.save(str(args.ormsd), matrix)
+    with metrics.stage('cluster'):
+        labels, centers = cluster_rmsd(matrix,cutoff)
+    print_clusters(clusterfile,pdblist,labels,centers)
+    print(str(len(pdblist)) + ' models in ' + str(len(centers)) + ' clusters within ' + str(cutoff) + ' A, the centers of the largest clusters are:')
+    for label, mdl in enumerate(centers[:10]):
+        print('%s %d models' % (pdblist[mdl], (labels == label).sum()))
+
+if __name__ == '__main__':
+    main()
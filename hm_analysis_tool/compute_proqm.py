@@ -5,6 +5,23 @@ import shutil
 import subprocess
 import glob
 import re
+import queue
+import json
+import hashlib
+import threading
+import concurrent.futures
+from hm_analysis_tool import profile_cache
+from hm_analysis_tool import metrics
+from hm_analysis_tool.errors import HMAnalysisError, exit_on_error
+
+#patched terminal atoms removed from the models before scoring
+TERMINAL_ATOMS = (' CAY ',' CY ',' OY ', ' NT ', ' CAT ')
+#serializes the writes to the run journal from the scoring threads
+JOURNAL_LOCK = threading.Lock()
+#default locations of Rosetta and the ProQ scripts
+ROSETTA_SCORE_APP = '/data/TMB-CSB/apps/CentOS7-LabLinux/rosetta/3.9/main/source/bin/score.static.linuxgccrelease'
+PROQM_SCRIPT = '/data/TMB-CSB/apps/CentOS7-LabLinux/ProQ_scripts/vl/bin'
+ROSETTA_DB = '/data/TMB-CSB/apps/CentOS7-LabLinux/rosetta/3.9/main/database/'
 
 def get_parser(args):
     '''Define inputs by the user from the command line'''
@@ -14,45 +31,78 @@ def get_parser(args):
     parser.add_argument("-alignment_pir", help="full path to the alignment modeller PIR file between target and template, template name and rootname of models will be read from the alignment file", required=True)
     parser.add_argument("-full_seq_mdl", help="full-length sequence of the model in fasta format (file has to be in the working directory)", dest="fasta_mdl" )
     parser.add_argument("-full_seq_template", help="full-length sequence of the model in fasta format (file has to be in the working directory)", dest="fasta_template")
-    parser.add_argument("-rosetta_score_app", help="Rosetta score application (default: /data/TMB-CSB/apps/CentOS7-LabLinux/rosetta/3.9/main/source/bin/score.static.linuxgccrelease)", default="/data/TMB-CSB/apps/CentOS7-LabLinux/rosetta/3.9/main/source/bin/score.static.linuxgccrelease")
-    parser.add_argument("-proqm_script", help="ProQ master script bin folder (default: /data/TMB-CSB/apps/CentOS7-LabLinux/ProQ_scripts/vl/bin)", default="/data/TMB-CSB/apps/CentOS7-LabLinux/ProQ_scripts/vl/bin")
-    parser.add_argument("-rosetta_db", help="Rosetta database folder (default: /data/TMB-CSB/apps/CentOS7-LabLinux/rosetta/3.9/main/database/)", default="/data/TMB-CSB/apps/CentOS7-LabLinux/rosetta/3.9/main/database/")
+    parser.add_argument("-rosetta_score_app", help="Rosetta score application (default: " + ROSETTA_SCORE_APP + ")", default=ROSETTA_SCORE_APP)
+    parser.add_argument("-proqm_script", help="ProQ master script bin folder (default: " + PROQM_SCRIPT + ")", default=PROQM_SCRIPT)
+    parser.add_argument("-rosetta_db", help="Rosetta database folder (default: " + ROSETTA_DB + ")", default=ROSETTA_DB)
+    parser.add_argument("-profile_cache", help="folder of the ProQM profile cache, profiles are reused when the sequence did not change (default: " + profile_cache.CACHE_ROOT + ")", default=profile_cache.CACHE_ROOT)
+    parser.add_argument("-profile_cache_size", help="maximum size of the ProQM profile cache in MB, the least recently used profiles are removed (default: no limit)")
+    parser.add_argument("-no_profile_cache", help="always compute the ProQM profiles, without using the cache", action='store_true')
+    parser.add_argument("-nproc", help="number of Rosetta score processes run in parallel for the models (default: 1)", default='1')
+    parser.add_argument("-timeout", help="seconds after which a Rosetta score process is killed (default: no timeout)")
+    parser.add_argument("-batch", help="number of models scored by each Rosetta score process, loading the database once per batch (default: 1)", default='1')
+    parser.add_argument("-no_pdbcl", help="clean the models inside the scoring jobs, without writing the *.pdbcl files in the working directory", action='store_true')
+    parser.add_argument("-journal", help="run journal used to resume an interrupted run, completed stages and models are skipped (default: proqm_journal.jsonl)", default='proqm_journal.jsonl')
+    parser.add_argument("-restart", help="ignore the run journal and compute everything again", action='store_true')
+    parser.add_argument("-retries", help="number of times a failed or timed out Rosetta score process is retried (default: 0)", default='0')
+    metrics.add_arguments(parser)
     return parser.parse_args(args)
     #modeller inst? write pir to fasta?
 
 ######### Functions ###############
-def check_file_existance(ofile):
-    '''check if the file file already exists'''
-    try:
-        f = open(ofile)
-        f.close()
-        print('the ' + str(ofile) + ' already exists, will be deleted')
-        os.remove(ofile)
-    except FileNotFoundError:
-        print('the ' + str(ofile) + ' will be created')
-
 def rootnm_from_pir(string, fp):
     '''get matched lines in a file'''
     for line in open(fp):
         if string in line:
             return line.split(":")[1]
 
+def read_pir(fp):
+    '''get the name and aligned sequence of the structure and sequence entries of a PIR alignment file,
+    structureX/structureN/structureM entries are returned as structure (the first one if there are several)'''
+    entries = {}
+    with open(fp) as f:
+        lines = [line.strip() for line in f]
+    for i, line in enumerate(lines):
+        if not line.startswith('>P1;') or i + 1 >= len(lines):
+            continue
+        header = lines[i + 1].split(':')
+        seq = []
+        for seqline in lines[i + 2:]:
+            seq.append(seqline)
+            if seqline.endswith('*'):
+                break
+        kind = 'structure' if header[0].startswith('structure') else header[0]
+        entries.setdefault(kind, (header[1], ''.join(seq).rstrip('*')))
+    for kind in ('structure', 'sequence'):
+        if kind not in entries:
+            raise HMAnalysisError('Cannot find the ' + kind + ' entry in the alignment file ' + str(fp))
+    return entries
+
 def find_not_matches(string1,string2,string3,string4,string5, fp):
     '''get not matched lines in a file'''
     for line in fp:
         if string1 not in line and string2 not in line and string3 not in line and string4 not in line and string5 not in line:
             yield line
 
-def print_clean_pdb(pdbin):
-    '''print a clean pdb without the patched terminal atoms'''
-    pdbout=str(pdbin) + 'cl'
-    check_file_existance(pdbout)
+def print_clean_pdb(pdbin,pdbout=None):
+    '''print a clean pdb without the patched terminal atoms, reading and writing the file once'''
+    if pdbout is None:
+        pdbout=str(pdbin) + 'cl'
+    metrics.count_files()
     with open(pdbin, 'r') as fp:
-        for line in find_not_matches(' CAY ',' CY ',' OY ', ' NT ', ' CAT ', fp):
-            with open(pdbout, 'a') as noterpdb:
-                noterpdb.write(line)
+        lines = list(find_not_matches(*TERMINAL_ATOMS, fp))
+    with open(pdbout, 'w') as noterpdb:
+        noterpdb.writelines(lines)
     return pdbout
 
+def clean_pdbs(pdbs,nproc=1):
+    '''print the clean pdbs of a list of models with a pool of nproc processes'''
+    if nproc > 1:
+        #the files read by the worker processes are not counted in this process
+        metrics.count_files(len(pdbs))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as executor:
+            return list(executor.map(print_clean_pdb, pdbs, chunksize=max(1, len(pdbs) // (nproc * 4))))
+    return [print_clean_pdb(pdb) for pdb in pdbs]
+
 def num_res(fp):
     '''Get the number of residues from the profile span file'''
     with open(fp) as open_file:
@@ -63,8 +113,7 @@ def get_listoffiles(directory,name):
     '''Get list of files and check if there are files in that directory'''
     listdir = glob.glob(directory + '/' + str(name) + '*.pdb')
     if len(listdir) == 0:
-        print('Cannot find files in starting with ' + str(name) + ' in the ' + str(directory) + ' directory')
-        sys.exit()
+        raise HMAnalysisError('Cannot find files in starting with ' + str(name) + ' in the ' + str(directory) + ' directory')
     return listdir
 
 def get_profile(proqmdir,fpdb,fullseq):
@@ -75,35 +124,286 @@ def get_profile(proqmdir,fpdb,fullseq):
         print('\n\n!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\nIMPORTANT: the full-sequence and the sequence from the pdb file MUST be 100% identical,\nexcept for the missing regions (it cannot contain mutations, i.e. variants to improve\ncrystallization or stabilize a conformation. If the pdb file has a mutation, change\nthe full-sequence accordingly before generating the ProQM profile\n!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!\n\n')
 
         print('Creating a ProQM profile for ' + str(fullseq) + '. This can take some time...')
-        proqm_allext = subprocess.Popen(["perl", str(proqmdir) + '/run_all_external.pl', '-fasta', str(fullseq), '-membrane', '1'], stdout=sys.stdout)
-        proqm_allext.communicate()
+        metrics.run_subprocess('run_all_external.pl', ["perl", str(proqmdir) + '/run_all_external.pl', '-fasta', str(fullseq), '-membrane', '1'], stdout=sys.stdout)
         print('Copy the profile features for the ' + str(fullseq) + ' to the sequence in the ' + str(fpdb) + ' PDB file')
-        proqm_copy = subprocess.Popen(["perl", str(proqmdir) + '/copy_features_from_master.pl', str(fpdb), str(fullseq)], stdout=sys.stdout)
-        proqm_copy.communicate()
+        metrics.run_subprocess('copy_features_from_master.pl', ["perl", str(proqmdir) + '/copy_features_from_master.pl', str(fpdb), str(fullseq)], stdout=sys.stdout)
     except FileNotFoundError:
         print('Creating a ProQM profile for the sequence in the PDB file ' + str(fpdb) + '. This can take some time...')
-        proqm_allext = subprocess.Popen(["perl", str(proqmdir) + '/run_all_external.pl', '-pdb', str(fpdb), '-membrane', '1'], stdout=sys.stdout)
-        proqm_allext.communicate()
+        metrics.run_subprocess('run_all_external.pl', ["perl", str(proqmdir) + '/run_all_external.pl', '-pdb', str(fpdb), '-membrane', '1'], stdout=sys.stdout)
 
-def compute_proqm(scoreapp,rosettadb,basename,pdb,nres):
-    '''Use Rosetta score application to compute ProqQM score for a pdb file'''
-    subprocess.call([str(scoreapp),
+def proqm_cmd(scoreapp,rosettadb,basename,pdb,nres,scorefile='ProQM.sc',listfile=None):
+    '''Rosetta score command line to compute the ProQM score of a pdb file, or of the pdb files in listfile'''
+    if listfile is not None:
+        infile = ['-in:file:l', str(listfile)]
+    else:
+        infile = ['-in:file:s', str(pdb)]
+    return [str(scoreapp),
                     '-database', str(rosettadb),
                     '-in:file:fullatom',
                     '-ProQ:basename', str(basename),
-                    '-in:file:s', str(pdb),
+                    *infile,
                     '-ignore_unrecognized_res',
                     '-Ntermini', 'ALL',
                     '-Ctermini', 'ALL',
-                    '-out:file:scorefile', 'ProQM.sc',
+                    '-out:file:scorefile', str(scorefile),
                     '-score:weights', 'ProQM',
                     '-ProQ:membrane',
                     '-read_only_ATOM_entries', 'true',
                     '-ProQ:normalize', str(nres),
-                    '-ProQ:output_local_prediction'])
+                    '-ProQ:output_local_prediction']
+
+def cached_profile(proqmdir,fpdb,fullseq,cache_root=None,max_size=None):
+    '''Restore the PROQM profile from the cache, or compute it and store it in the cache'''
+    if cache_root is None:
+        get_profile(proqmdir,fpdb,fullseq)
+        return
+    key = profile_cache.profile_key(fpdb,fullseq)
+    if profile_cache.cache_restore(cache_root,key,fpdb):
+        print('The ProQM profile for ' + str(fpdb) + ' was restored from the cache in ' + str(cache_root))
+        return
+    get_profile(proqmdir,fpdb,fullseq)
+    if not os.path.isfile(str(fpdb) + '.span'):
+        print('The ProQM profile for ' + str(fpdb) + ' was not created, it will not be cached')
+        return
+    os.makedirs(cache_root, exist_ok=True)
+    profile_cache.cache_store(cache_root,key,fpdb)
+    if max_size is not None:
+        profile_cache.cache_evict(cache_root,max_size)
+
+def compute_proqm(scoreapp,rosettadb,basename,pdb,nres):
+    '''Use Rosetta score application to compute ProqQM score for a pdb file'''
+    return metrics.run_subprocess('score', proqm_cmd(scoreapp,rosettadb,basename,pdb,nres)).returncode
+
+def run_job(cmd,cwd=None,timeout=None,retries=0):
+    '''Run a command, retrying it if it fails or times out, return True if it succeeded'''
+    for attempt in range(retries + 1):
+        try:
+            if metrics.run_subprocess('score', cmd, cwd=cwd, timeout=timeout).returncode == 0:
+                return True
+            print('The command ' + ' '.join(cmd) + ' failed (attempt ' + str(attempt + 1) + ')')
+        except subprocess.TimeoutExpired:
+            print('The command ' + ' '.join(cmd) + ' timed out after ' + str(timeout) + ' s (attempt ' + str(attempt + 1) + ')')
+    return False
+
+def read_scorefile(scorefile):
+    '''Get the header and the score lines of a Rosetta score file'''
+    header = None
+    rows = []
+    with open(scorefile) as f:
+        for line in f:
+            if not line.startswith('SCORE:'):
+                continue
+            if line.split()[-1] == 'description':
+                header = line
+            else:
+                rows.append(line)
+    return header, rows
+
+def merge_scorefiles(scorefiles,ofile):
+    '''Merge the score lines of several Rosetta score files into ofile, one line per description sorted by description'''
+    header = None
+    rows = []
+    if os.path.isfile(ofile):
+        header, rows = read_scorefile(ofile)
+    for scorefile in scorefiles:
+        if not os.path.isfile(scorefile):
+            continue
+        file_header, file_rows = read_scorefile(scorefile)
+        header = header or file_header
+        rows.extend(file_rows)
+    #rows of models scored again (changed inputs or failed batches of an interrupted run) replace the old ones
+    rows = sorted({row.split()[-1]: row for row in rows}.values(), key=lambda row: row.split()[-1])
+    tmpfile = ofile + '.tmp' + str(os.getpid())
+    with open(tmpfile, 'w') as f:
+        if header is not None:
+            f.write(header)
+        f.writelines(rows)
+    os.replace(tmpfile, ofile)
+
+def absolute_path(path):
+    '''Absolute path of a file, commands found in the PATH are not changed'''
+    if os.sep in str(path) or os.path.exists(str(path)):
+        return os.path.abspath(str(path))
+    return str(path)
+
+def make_batches(pdbs,batch=1):
+    '''Split the list of pdbs in chunks of batch pdbs'''
+    return [pdbs[i:i+batch] for i in range(0, len(pdbs), batch)]
+
+def schedule_proqm(scoreapp,rosettadb,basename,pdbs,nres,nproc=1,timeout=None,retries=0,scorefile='ProQM.sc',workroot='proqm_workers',batch=1,clean=False,on_done=None):
+    '''Compute the ProQM score of the pdbs with nproc Rosetta processes, each one writing in its own folder
+    and scoring batch pdbs at a time. With clean, the pdbs are cleaned in the worker folder just before scoring.
+    on_done(pdbs,ok) is called after each batch. The score files, including the ones left by an interrupted run,
+    are merged into scorefile and the local predictions moved to the working directory.
+    Return the list of pdbs that could not be scored'''
+    outdir = os.getcwd()
+    workdirs = [os.path.join(outdir, workroot, 'worker_' + str(i)) for i in range(nproc)]
+    slots = queue.Queue()
+    for workdir in workdirs:
+        os.makedirs(workdir, exist_ok=True)
+        slots.put(workdir)
+
+    def job(inputs):
+        workdir = slots.get()
+        chunk = inputs
+        if clean:
+            chunk = [os.path.join(workdir, os.path.basename(pdb) + 'cl') for pdb in inputs]
+        try:
+            if clean:
+                try:
+                    for pdb, pdbout in zip(inputs, chunk):
+                        print_clean_pdb(pdb, pdbout)
+                except OSError as error:
+                    #a model deleted or moved after listing fails its batch, the worker slot is still returned
+                    print('The batch of ' + str(inputs[0]) + ' could not be cleaned: ' + str(error))
+                    if on_done is not None:
+                        on_done(inputs,False)
+                    return False
+            if len(chunk) > 1:
+                listfile = os.path.join(workdir,'models.list')
+                with open(listfile, 'w') as f:
+                    f.writelines(absolute_path(pdb) + '\n' for pdb in chunk)
+            else:
+                listfile = None
+            cmd = proqm_cmd(absolute_path(scoreapp),absolute_path(rosettadb),absolute_path(basename),absolute_path(chunk[0]),nres,os.path.join(workdir,'ProQM.sc'),listfile)
+            ok = run_job(cmd,workdir,timeout,retries)
+            if on_done is not None:
+                on_done(inputs,ok)
+            return ok
+        finally:
+            if clean:
+                for pdb in chunk:
+                    if os.path.isfile(pdb):
+                        os.remove(pdb)
+            slots.put(workdir)
+
+    chunks = make_batches(pdbs,batch)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nproc) as executor:
+        done = list(executor.map(job, chunks))
+
+    allworkdirs = sorted(glob.glob(os.path.join(outdir, workroot, 'worker_*')))
+    merge_scorefiles([os.path.join(workdir,'ProQM.sc') for workdir in allworkdirs],scorefile)
+    for workdir in allworkdirs:
+        for ifile in sorted(os.listdir(workdir)):
+            if ifile not in ('ProQM.sc', 'models.list') and not ifile.endswith('.pdbcl'):
+                shutil.move(os.path.join(workdir,ifile), os.path.join(outdir,ifile))
+    shutil.rmtree(os.path.join(outdir, workroot))
+
+    failed = [pdb for chunk, ok in zip(chunks, done) if not ok for pdb in chunk]
+    if len(failed) > 0:
+        print(str(len(failed)) + ' models could not be scored: ' + ', '.join(failed))
+    return failed
+
+def fingerprint(*items):
+    '''Hash of the items, files are identified by their name, size and modification time'''
+    key = []
+    for item in items:
+        if os.path.isfile(str(item)):
+            stat = os.stat(str(item))
+            key.append('%s:%d:%d' % (item, stat.st_size, stat.st_mtime_ns))
+        else:
+            key.append(str(item))
+    return hashlib.sha256('\n'.join(key).encode()).hexdigest()
+
+def read_journal(journalfile):
+    '''Get the last status of each stage and item of the run journal'''
+    journal = {}
+    try:
+        with open(journalfile) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    #last line of a run killed while writing
+                    continue
+                journal[(entry['stage'], entry['item'])] = (entry['fingerprint'], entry['status'])
+    except FileNotFoundError:
+        pass
+    return journal
+
+def write_journal(journalfile,journal,stage,item,fprint,status):
+    '''Record the status of a stage and item in the run journal'''
+    with JOURNAL_LOCK:
+        journal[(stage, str(item))] = (fprint, status)
+        with open(journalfile, 'a') as f:
+            f.write(json.dumps({'stage': stage, 'item': str(item), 'fingerprint': fprint, 'status': status}) + '\n')
+
+def stage_done(journal,stage,item,fprint):
+    '''check if a stage of an item was completed with the same inputs'''
+    return journal.get((stage, str(item))) == (fprint, 'done')
+
+def journal_profile(journalfile,journal,stage,proqmdir,fpdb,fullseq,cache_root=None,max_size=None):
+    '''Compute the PROQM profile unless the journal has it done with the same sequence'''
+    fprint = profile_cache.profile_key(fpdb,fullseq)
+    if stage_done(journal,stage,fpdb,fprint) and os.path.isfile(str(fpdb) + '.span'):
+        print('The ProQM profile for ' + str(fpdb) + ' is already done, skipping...')
+        return
+    cached_profile(proqmdir,fpdb,fullseq,cache_root,max_size)
+    status = 'done' if os.path.isfile(str(fpdb) + '.span') else 'failed'
+    write_journal(journalfile,journal,stage,fpdb,fprint,status)
+
+def run_proqm(tmpldir,alignment_pir,fasta_mdl='',fasta_template='',rosetta_score_app=ROSETTA_SCORE_APP,proqm_script=PROQM_SCRIPT,rosetta_db=ROSETTA_DB,
+              nproc=1,timeout=None,retries=0,batch=1,no_pdbcl=False,cache_root=profile_cache.CACHE_ROOT,cache_size=None,journalfile='proqm_journal.jsonl',mdls_pdblist=None):
+    '''Compute the PROQM score of the template and the models in the working directory (or of mdls_pdblist).
+    Return the list of models that could not be scored'''
+    outdir = os.getcwd()
+    journalfile = os.path.abspath(str(journalfile))
+
+    #get proqm profile for the template
+    template_name=rootnm_from_pir("structure",alignment_pir)
+    tempstr = str(template_name) + '.pdb'
+    shutil.copy(tmpldir + '/' + str(template_name) + '.pdb',outdir)
+    journal = read_journal(journalfile)
+    with metrics.stage('template_profile'):
+        journal_profile(journalfile,journal,'template_profile',proqm_script,tempstr,fasta_template,cache_root,cache_size)
+
+    #get proqm profile for the model
+    if mdls_pdblist is None:
+        mdls_rootnm=rootnm_from_pir("sequence",alignment_pir)
+        mdls_pdblist = get_listoffiles(outdir,mdls_rootnm)
+    mdls_pdblist = sorted(mdls_pdblist)
+    one_mdl=mdls_pdblist[0]
+    with metrics.stage('model_profile'):
+        journal_profile(journalfile,journal,'model_profile',proqm_script,one_mdl,fasta_mdl,cache_root,cache_size)
+
+    #compute proqm score for the template
+    ntemp=num_res(str(tempstr)+'.span')
+    fprint = fingerprint(profile_cache.profile_key(tempstr,fasta_template),ntemp,rosetta_score_app)
+    if stage_done(journal,'template_score',tempstr,fprint):
+        print('The ProQM score for ' + str(tempstr) + ' is already done, skipping...')
+    else:
+        with metrics.stage('template_score'):
+            status = 'done' if compute_proqm(rosetta_score_app,rosetta_db,tempstr,tempstr,ntemp) == 0 else 'failed'
+        write_journal(journalfile,journal,'template_score',tempstr,fprint,status)
+
+    #iterate computation of proqm score for the models not scored yet
+    nmdl=num_res(str(one_mdl)+'.span')
+    score_prints = {mod_i: fingerprint(mod_i,nmdl,one_mdl,rosetta_score_app) for mod_i in mdls_pdblist}
+    todo = [mod_i for mod_i in mdls_pdblist if not stage_done(journal,'score',mod_i,score_prints[mod_i])]
+    print(str(len(mdls_pdblist) - len(todo)) + ' of ' + str(len(mdls_pdblist)) + ' models are already scored')
+    if no_pdbcl:
+        scored = {mod_i: mod_i for mod_i in todo}
+    else:
+        clean_prints = {mod_i: fingerprint(mod_i) for mod_i in todo}
+        toclean = [mod_i for mod_i in todo if not (stage_done(journal,'clean',mod_i,clean_prints[mod_i]) and os.path.isfile(str(mod_i) + 'cl'))]
+        with metrics.stage('clean'):
+            cleaned = clean_pdbs(toclean,nproc)
+        for mod_i in cleaned:
+            write_journal(journalfile,journal,'clean',mod_i[:-2],clean_prints[mod_i[:-2]],'done')
+        scored = {str(mod_i) + 'cl': mod_i for mod_i in todo}
+
+    def on_done(pdbs,ok):
+        for pdb in pdbs:
+            write_journal(journalfile,journal,'score',scored[pdb],score_prints[scored[pdb]],'done' if ok else 'failed')
+
+    with metrics.stage('score'):
+        return schedule_proqm(rosetta_score_app,rosetta_db,one_mdl,list(scored),nmdl,nproc,timeout,retries,batch=batch,clean=no_pdbcl,on_done=on_done)
+
+@exit_on_error
 def main():
     '''Main entry point'''
     args = get_parser(sys.argv[1:])
+    metrics.setup(args,'compute_proqm')
     ########### Variables ###############
     # Output files/directories
     tmpldir = str(args.tmpldir)
@@ -119,30 +419,29 @@ def main():
         fasta_mdl = ""
     rosetta_score_app=str(args.rosetta_score_app)
     rosetta_db=str(args.rosetta_db)
+    nproc = int(args.nproc)
+    if args.timeout != None:
+        timeout = float(args.timeout)
+    else:
+        timeout = None
+    retries = int(args.retries)
+    batch = int(args.batch)
+    no_pdbcl = args.no_pdbcl
+    if args.no_profile_cache:
+        cache_root = None
+    else:
+        cache_root = str(args.profile_cache)
+    if args.profile_cache_size != None:
+        cache_size = float(args.profile_cache_size) * 1024 * 1024
+    else:
+        cache_size = None
+    journalfile = str(args.journal)
+    if args.restart and os.path.isfile(journalfile):
+        os.remove(journalfile)
     ####################################################
 
-    outdir = os.getcwd()
-
-    #get proqm profile for the template
-    template_name=rootnm_from_pir("structure",alignment_pir)
-    tempstr = str(template_name) + '.pdb'
-    shutil.copy(tmpldir + '/' + str(template_name) + '.pdb',outdir)
-    get_profile(proqm_script,tempstr,fasta_template)
-
-    #get proqm profile for the model
-    mdls_rootnm=rootnm_from_pir("sequence",alignment_pir)
-    mdls_pdblist = get_listoffiles(outdir,mdls_rootnm)
-    one_mdl=mdls_pdblist[0]
-    get_profile(proqm_script,one_mdl,fasta_mdl)
-
-    #compute proqm score for the template
-    ntemp=num_res(str(tempstr)+'.span')
-    compute_proqm(rosetta_score_app,rosetta_db,tempstr,tempstr,ntemp)
-
-    #iterate computation of proqm score for all models
-    nmdl=num_res(str(one_mdl)+'.span')
-    [print_clean_pdb(mod_i) for mod_i in mdls_pdblist]
-    [compute_proqm(rosetta_score_app,rosetta_db,one_mdl,str(mod_i) + 'cl',nmdl) for mod_i in mdls_pdblist]
+    run_proqm(tmpldir,alignment_pir,fasta_mdl,fasta_template,rosetta_score_app,proqm_script,rosetta_db,
+              nproc,timeout,retries,batch,no_pdbcl,cache_root,cache_size,journalfile)
 
 
 #compare the profiles with the alignment
@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+import sys
+import functools
+
+class HMAnalysisError(Exception):
+    '''Error of an analysis stage, the command line scripts print it and exit'''
+
+def exit_on_error(main):
+    '''Print the HMAnalysisError raised by a main entry point and exit'''
+    @functools.wraps(main)
+    def wrapper(*args, **kwargs):
+        try:
+            return main(*args, **kwargs)
+        except HMAnalysisError as e:
+            print(e)
+            sys.exit()
+    return wrapper
@@ -2,53 +2,148 @@
 import math
 import argparse
 import sys, os
+import numpy as np
 import pandas as pd
 import shutil
+import collections
+import errno
+import concurrent.futures
+from hm_analysis_tool import score_io
+from hm_analysis_tool import get_molpdf
+from hm_analysis_tool import metrics
+from hm_analysis_tool.errors import HMAnalysisError, exit_on_error
+
+LINK_MODES = ['copy', 'hardlink', 'symlink', 'reflink']
+#ioctl request to clone a file (Linux btrfs/xfs), see ioctl_ficlone(2)
+FICLONE = 0x40049409
 
 def get_parser(args):
     '''Define inputs by the user from the command line'''
     ########## Input/output and options from user ###
-    parser = argparse.ArgumentParser(description = 'Script to extract pdb files that have a MOLPDF score below a given threshold OR a percentage of the lowest MOPDF scored structures')
-    parser.add_argument("-scorefile", help="input score file, format PDB_NAME MOLPDF_SCORE")
-    parser.add_argument("-outdir", help="folder to write extracted pdb files")
-    group = parser.add_mutually_exclusive_group(required=True)
-    group.add_argument('-percent', dest="perc", help="percentage of lowest MOLPDF score to extract")
-    group.add_argument('-threshold', dest="thres", help="MOLPDF score threshold of the models to extract")
-    return parser.parse_args(args)
+    parser = argparse.ArgumentParser(description = 'Script to extract pdb files that have a MOLPDF score below a given threshold AND/OR a percentage of the lowest MOPDF scored structures')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("-scorefile", help="input score file, format PDB_NAME MOLPDF_SCORE, text or binary .npy")
+    source.add_argument("-pdbdir", help="read the scores straight from the pdb files in this directory instead of a score file")
+    parser.add_argument("-rootname", help="with -pdbdir, rootname of the pdb files (i.e. gly1.B)", dest="rootnm", default='')
+    parser.add_argument("-pattern", help="with -pdbdir, pattern in pdb file to search for score, (default='MODELLER OBJECTIVE FUNCTION')", default='MODELLER OBJECTIVE FUNCTION')
+    parser.add_argument("-col", help="with -pdbdir, column of MOLPDF score value in matched line of pdb (default=5)", default='5')
+    parser.add_argument("-outdir", help="folder to write extracted pdb files, a comma separated list gives one folder per percentage")
+    parser.add_argument("-link-mode", dest="link_mode", choices=LINK_MODES, help="how to place the pdb files in outdir, falls back to copy if the filesystem does not support it (default: copy)", default='copy')
+    parser.add_argument("-nproc", help="number of threads copying (and with -pdbdir, processes reading) the pdb files (default: 1)", default='1')
+    parser.add_argument('-percent', dest="perc", help="percentage of lowest MOLPDF score to extract, a comma separated list extracts each percentage to its own -outdir")
+    parser.add_argument('-threshold', dest="thres", help="MOLPDF score threshold of the models to extract, combined with -percent only the models below the threshold are extracted")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(args)
+    if args.perc == None and args.thres == None:
+        parser.error('one of the arguments -percent -threshold is required')
+    return args
 
 ######### Functions ###############
 
+def read_score_df(ifile):
+    '''Get the score dataframe from a score file, or use it directly if it is already a dataframe'''
+    if isinstance(ifile, pd.DataFrame):
+        return ifile
+    return score_io.read_scores(ifile)
+
+def scan_scores(pdbdir,rootnm,pattern,col,nproc=1):
+    '''Get the score dataframe straight from the pdb files, without a score file'''
+    pdblist = get_molpdf.get_listoffiles(pdbdir,rootnm)
+    scores = get_molpdf.getscore(pdblist,pattern,col,nproc)
+    return pd.DataFrame({'pdbname': scores['col1'].values, 'molpdf': scores['col2'].astype(float).values})
+
+def select_underthres(df,threshold):
+    '''Get the rows of the score dataframe below a given threshold'''
+    return df[df.molpdf < threshold]
+
+def select_best_perc(df,perc):
+    '''Get the rows of the lowest score X % structures sorted by score, without sorting the whole dataframe'''
+    tot_mdls = df.shape[0]
+    num_mdls = math.ceil(tot_mdls * (perc / 100))
+    if num_mdls <= 0:
+        return df.iloc[:0]
+    scores = df['molpdf'].to_numpy(dtype=float)
+    if num_mdls < tot_mdls:
+        #nan scores are placed at the end by the partition, as with na_position='last'
+        idx = np.argpartition(scores, num_mdls - 1)[:num_mdls]
+    else:
+        idx = np.arange(tot_mdls)
+    idx = idx[np.argsort(scores[idx], kind='stable')]
+    return df.iloc[idx]
+
 def get_underthres(ifile,threshold):
     '''Get the list of pdbs below a given threshold'''
-    df_from_file = pd.read_csv(ifile, delimiter= '\s+', names = ["pdbname", "molpdf"])
-    filter_df = df_from_file[df_from_file.molpdf < threshold]
+    filter_df = select_underthres(read_score_df(ifile),threshold)
     filter_list = filter_df['pdbname'].values.tolist()
     return filter_list
 
 def get_best_perc(ifile,perc):
     '''Get the lowest score X % structures'''
-    df_from_file = pd.read_csv(ifile, delimiter= '\s+', names = ["pdbname", "molpdf"])
-    df_from_file.sort_values("molpdf", axis = 0, ascending = True, inplace = True, na_position ='last')
-    tot_mdls = df_from_file.shape[0]
-    num_mdls = math.ceil(tot_mdls * (perc / 100))
-    xtx = df_from_file.head(num_mdls)
+    xtx = select_best_perc(read_score_df(ifile),perc)
     xtx_score = xtx.tail(1)['molpdf'].values.tolist()
     list_pdb = xtx['pdbname'].values.tolist()
     return (xtx_score, list_pdb)
 
-def create_outdir(odir,files):
+def reflink(src,dst):
+    '''Clone src to dst sharing the data blocks, raise OSError if not supported'''
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copymode(src, dst)
+
+def place_file(src,path,link_mode='copy'):
+    '''Put src in the path directory with link_mode, return the mode that was used'''
+    dst = os.path.join(path, os.path.basename(src))
+    try:
+        if link_mode == 'hardlink':
+            os.link(src, dst)
+        elif link_mode == 'symlink':
+            os.symlink(os.path.abspath(src), dst)
+        elif link_mode == 'reflink':
+            reflink(src, dst)
+        else:
+            shutil.copy(src, dst)
+            return 'copy'
+    except OSError as e:
+        if e.errno == errno.EEXIST:
+            raise
+        shutil.copy(src, dst)
+        return 'copy'
+    return link_mode
+
+def place_files(files,path,link_mode='copy',nproc=1):
+    '''Put files in the path directory, with a pool of nproc threads'''
+    if nproc > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nproc) as executor:
+            modes = list(executor.map(lambda f: place_file(f,path,link_mode), files))
+    else:
+        modes = [place_file(f,path,link_mode) for f in files]
+    if link_mode != 'copy' and 'copy' in modes:
+        print('%d of %d pdbs could not use %s and were copied' % (modes.count('copy'), len(modes), link_mode))
+    return modes
+
+def create_outdir(odir,files,link_mode='copy',nproc=1):
     '''Create out directory and copy files to it'''
     path = str(os.getcwd()) + '/' + odir
 
+    #models of different pdb directories with the same name would overwrite each other in odir
+    counts = collections.Counter(os.path.basename(f) for f in files)
+    duplicated = sorted(set(f for f in files if counts[os.path.basename(f)] > 1))
+    if len(duplicated) > 0:
+        raise HMAnalysisError("The selected pdbs %s have the same file name and cannot be placed in %s. Exiting..." % (', '.join(duplicated), path))
+
     try:
         os.mkdir(path)
     except OSError:
-        print ("The directory %s already exists and it will not be overwritten. Exiting..." % path)
-        sys.exit()
+        raise HMAnalysisError("The directory %s already exists and it will not be overwritten. Exiting..." % path)
     else:
         print ("The %s directory will be created and pdbs will be copied" % path)
-        for f in files:
-            shutil.copy(f,path)
+        place_files(files,path,link_mode,nproc)
 
 def print_log_thr(odir,threshold,tot):
     '''Print a log file with the threshold info'''
@@ -64,28 +159,58 @@ def print_log_perc(odir,perc,score,tot):
     flog.write("%s percent of PDB structure with lowest MOLPDF score: %d mdls, highest score is %.4f" % (perc,tot,score))
     flog.close()
 
+def print_log_perc_thr(odir,perc,threshold,score,tot):
+    '''Print a log file with the percentage and threshold info'''
+    logfile = str(os.getcwd()) + '/' + odir + '/log.txt'
+    flog = open(logfile,"w")
+    flog.write("%s percent of PDB structure with lowest MOLPDF score and below %s MOLPDF score: %d mdls, highest score is %.4f" % (perc,threshold,tot,score))
+    flog.close()
+
+@exit_on_error
 def main():
     '''Main entry point'''
     args = get_parser(sys.argv[1:])
+    metrics.setup(args,'extract_str')
     ########### Variables ###############
-    scorefile = str(args.scorefile)
     # Output files/directories
-    outdir = str(args.outdir)
+    outdirs = str(args.outdir).split(',')
+    link_mode = str(args.link_mode)
+    nproc = int(args.nproc)
 
-    ## Define analysis by perc of mdls or under threshold
-    if args.perc != None:
-        perc=int(args.perc)
-        xtx_score, list_pdb = (get_best_perc(scorefile,perc))
-        create_outdir(outdir,list_pdb)
-        num_mdls = len(list_pdb)
-        print_log_perc(outdir,perc,xtx_score[0],num_mdls)
+    #read the scores once for all the queries
+    with metrics.stage('read_scores'):
+        if args.pdbdir != None:
+            scores = scan_scores(str(args.pdbdir),str(args.rootnm),str(args.pattern),int(args.col),nproc)
+        else:
+            scores = score_io.read_scores(str(args.scorefile))
 
-    if args.thres != None:
+    ## Define analysis by perc of mdls, under threshold or both
+    if args.perc != None:
+        percs = [int(perc) for perc in str(args.perc).split(',')]
+        if len(percs) != len(outdirs):
+            raise HMAnalysisError('The number of percentages and output folders must be the same. Exiting...')
+        for perc, outdir in zip(percs, outdirs):
+            with metrics.stage('select'):
+                xtx = select_best_perc(scores,perc)
+                if args.thres != None:
+                    xtx = select_underthres(xtx,int(args.thres))
+            list_pdb = xtx['pdbname'].values.tolist()
+            xtx_score = xtx.tail(1)['molpdf'].values.tolist() or [float('nan')]
+            with metrics.stage('create_outdir'):
+                create_outdir(outdir,list_pdb,link_mode,nproc)
+            num_mdls = len(list_pdb)
+            if args.thres != None:
+                print_log_perc_thr(outdir,perc,int(args.thres),xtx_score[0],num_mdls)
+            else:
+                print_log_perc(outdir,perc,xtx_score[0],num_mdls)
+    else:
         thres = int(args.thres)
-        list_pdb = (get_underthres(scorefile,thres))
-        create_outdir(outdir,list_pdb)
+        with metrics.stage('select'):
+            list_pdb = select_underthres(scores,thres)['pdbname'].values.tolist()
+        with metrics.stage('create_outdir'):
+            create_outdir(outdirs[0],list_pdb,link_mode,nproc)
         num_mdls = len(list_pdb)
-        print_log_thr(outdir,thres,num_mdls)
+        print_log_thr(outdirs[0],thres,num_mdls)
    
 if __name__ == '__main__':
     main()
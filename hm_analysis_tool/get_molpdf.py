@@ -1,19 +1,58 @@
 #!/usr/bin/env python
-import sys
+import sys, os
 import argparse
-import glob
+import gzip
+import re
+import zlib
+import json
+import concurrent.futures
 import pandas as pd
 import numpy as np
+from hm_analysis_tool import score_io
+from hm_analysis_tool import metrics
+from hm_analysis_tool.errors import HMAnalysisError, exit_on_error
+
+#PDB records that mark the end of the header/REMARK block
+COORD_RECORDS = ('ATOM', 'HETATM', 'MODEL')
+#columns of the on-disk score index, files without a matched score have an empty col2
+INDEX_COLUMNS = ['col1', 'size', 'mtime', 'col2']
+#first line of the score index, it records the pattern and column the scores were read with
+INDEX_HEADER = '#hm_analysis_tool index '
+#record of the MODELLER key: value lines
+REMARK_RECORD = 'REMARK   6 '
 
 def get_parser(args):
     '''Define inputs by the user from the command line'''
     ########## Input/output and options from user ###
     parser = argparse.ArgumentParser(description = 'Script to get all MODELLER molpdf scores from a list of pdb files in a given directory')
-    parser.add_argument("-pdbdir", help="directory of the input pdb file(s)", required=True)
+    parser.add_argument("-pdbdir", help="directory of the input pdb file(s), a comma separated list reads several directories", required=True)
     parser.add_argument("-rootname", help="specify rootname of the pdb files (i.e. gly1.B)", dest="rootnm", required=True)
-    parser.add_argument("-o", dest="scorefile", help="output score file", default="molpdf.txt")
+    parser.add_argument("-o", dest="scorefile", help="output score file, written in binary if it ends with .npy", default="molpdf.txt")
     parser.add_argument("-pattern", help="pattern in pdb file to search for score, (default='MODELLER OBJECTIVE FUNCTION')", default='MODELLER OBJECTIVE FUNCTION')
     parser.add_argument("-col", help="column of MOLPDF score value in matched line of pdb (default=5)", default='5')
+    parser.add_argument("-nproc", help="number of worker processes used to scan the pdb files (default=1)", default='1')
+    parser.add_argument("-update", help="update an existing score file, only new or modified pdb files are scanned", action='store_true')
+    parser.add_argument("-index", help="score index file used by -update (default: <scorefile>.idx)")
+    parser.add_argument("-fields", help="also write a table with one column per REMARK 6 field (i.e. DOPE score, GA341 score) read in the same pass, tab separated or binary if it ends with .npy")
+    parser.add_argument("-shard", "--shard", help="score only the shard i of N (i.e. 2/8) of the pdb files, the partial score files are combined with merge_molpdf")
+    metrics.add_arguments(parser)
+    args = parser.parse_args(args)
+    if args.fields != None and args.update:
+        parser.error('the argument -fields cannot be used with -update')
+    if args.shard != None:
+        try:
+            parse_shard(args.shard)
+        except ValueError as error:
+            parser.error(str(error))
+    return args
+
+def get_merge_parser(args):
+    '''Define inputs by the user from the command line of merge_molpdf'''
+    ########## Input/output and options from user ###
+    parser = argparse.ArgumentParser(description = 'Script to merge the partial score files written by get_molpdf -shard into a score file sorted by pdb name')
+    parser.add_argument("partials", help="partial score files, text or binary (.npy)", nargs='+')
+    parser.add_argument("-o", dest="scorefile", help="output score file, written in binary if it ends with .npy", default="molpdf.txt")
+    metrics.add_arguments(parser)
     return parser.parse_args(args)
 
 ######### Functions ###############
@@ -21,42 +60,236 @@ def lines_match(string, fp):
     '''make a list of matched lines in a file'''
     return [line for line in fp if string in line]
 
-def getscore(listfiles,pattern,col):
+def header_lines(fp):
+    '''yield the lines of a pdb file until the first coordinate record'''
+    for line in fp:
+        if line.startswith(COORD_RECORDS):
+            return
+        yield line
+
+def open_pdb(ifile):
+    '''open a pdb file for reading, gzip compressed if its name ends with .gz'''
+    if str(ifile).endswith('.gz'):
+        return gzip.open(ifile,'rt')
+    return open(ifile,'r')
+
+def scan_file(ifile,pattern,col):
+    '''Get the col of the header lines matching a pattern in a single file'''
+    matches = []
+    metrics.count_files()
+    try:
+        with open_pdb(ifile) as f:
+            for line in lines_match(pattern, header_lines(f)):
+                matches.append((ifile, line.strip().split()[col]))
+    except IndexError:
+        print('input column of pdb file score line is not correct')
+    return matches
+
+def getscore(listfiles,pattern,col,nproc=1):
     '''From a set of files extract a dataframe with the file name and col of lines matching a pattern in that file'''
     column1 = []
     column2 = []
-    for ifile in listfiles:
-        try:
-            with open(ifile,'r') as f:
-                for line in lines_match(pattern, f):
-                    column1.append(ifile)
-                    column2.append(line.strip().split()[col])
-        except IndexError:
-            print('input column of pdb file score line is not correct')
+    if nproc > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as executor:
+            chunk = max(1, len(listfiles) // (nproc * 4))
+            results = list(executor.map(scan_file, listfiles, [pattern] * len(listfiles), [col] * len(listfiles), chunksize=chunk))
+        #the files read by the worker processes are not counted in this process
+        metrics.count_files(len(listfiles))
+    else:
+        results = [scan_file(ifile, pattern, col) for ifile in listfiles]
+    for matches in results:
+        for ifile, value in matches:
+            column1.append(ifile)
+            column2.append(value)
     col1col2 = pd.DataFrame(list(zip(column1,column2)), columns=['col1','col2'])
     return col1col2.sort_values(by=['col1'])
 
+def get_filestats(listfiles):
+    '''Get a dataframe with the size and modification time of a list of files'''
+    rows = []
+    for ifile in listfiles:
+        stat = os.stat(ifile)
+        rows.append((ifile, stat.st_size, stat.st_mtime_ns))
+    return pd.DataFrame(rows, columns=['col1','size','mtime']).astype({'col1': str, 'size': np.int64, 'mtime': np.int64})
+
+def index_settings(pattern,col):
+    '''Settings of the scores stored in the index'''
+    return {'pattern': str(pattern), 'col': int(col)}
+
+def read_index(indexfile,pattern,col):
+    '''Read the score index file, an empty index is returned if the file does not exist
+    or its scores were read with another pattern or column'''
+    dtypes = {'col1': str, 'size': np.int64, 'mtime': np.int64, 'col2': str}
+    empty = pd.DataFrame({column: pd.Series(dtype=dtypes[column]) for column in INDEX_COLUMNS})
+    try:
+        with open(indexfile) as f:
+            header = f.readline()
+            try:
+                settings = json.loads(header[len(INDEX_HEADER):]) if header.startswith(INDEX_HEADER) else None
+            except ValueError:
+                settings = None
+            if settings != index_settings(pattern,col):
+                print('The index ' + str(indexfile) + ' was not written with the pattern ' + str(pattern) + ' and column ' + str(col) + ', all the pdb files will be scanned')
+                return empty
+            return pd.read_csv(f, sep='\t', dtype=dtypes, keep_default_na=False)
+    except FileNotFoundError:
+        return empty
+
+def write_index(indexfile,index,pattern,col):
+    '''Write the score index file with the pattern and column of its scores'''
+    with open(indexfile, 'w') as f:
+        f.write(INDEX_HEADER + json.dumps(index_settings(pattern,col)) + '\n')
+        index.to_csv(f, sep='\t', columns=INDEX_COLUMNS, index=False)
+
+def update_index(index,listfiles,pattern,col,nproc=1):
+    '''Scan only the new or modified files of listfiles and drop the deleted ones from the index'''
+    stats = get_filestats(listfiles)
+    known = index[['col1','size','mtime']].drop_duplicates()
+    merged = stats.merge(known, on=['col1','size','mtime'], how='left', indicator=True)
+    changed = merged.loc[merged['_merge'] == 'left_only', 'col1'].tolist()
+    unchanged = index[index['col1'].isin(merged.loc[merged['_merge'] == 'both', 'col1'])]
+    scores = getscore(changed,pattern,col,nproc)
+    scanned = stats[stats['col1'].isin(changed)].merge(scores, on='col1', how='left').fillna({'col2': ''})
+    updated = pd.concat([unchanged, scanned[INDEX_COLUMNS]], ignore_index=True)
+    return updated.sort_values(by=['col1']).reset_index(drop=True), len(changed)
+
+def index_scores(index):
+    '''Get the file name and score columns of the index for the files with a matched score'''
+    return index.loc[index['col2'] != '', ['col1','col2']]
+
+def scan_remarks(ifile):
+    '''Get the key: value pairs of the REMARK 6 lines in the header of a pdb file, repeated keys are joined by ;'''
+    fields = {}
+    metrics.count_files()
+    with open_pdb(ifile) as f:
+        for line in header_lines(f):
+            if not line.startswith(REMARK_RECORD) or ': ' not in line:
+                continue
+            key, value = line[len(REMARK_RECORD):].split(': ', 1)
+            key = key.strip()
+            value = value.strip()
+            if key in fields:
+                fields[key] = fields[key] + '; ' + value
+            else:
+                fields[key] = value
+    return fields
+
+def getremarks(listfiles,nproc=1):
+    '''From a set of files extract a dataframe with the file name and one column per REMARK 6 field,
+    the values are kept as read and the fields missing in a file are nan'''
+    if nproc > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nproc) as executor:
+            results = list(executor.map(scan_remarks, listfiles, chunksize=max(1, len(listfiles) // (nproc * 4))))
+        #the files read by the worker processes are not counted in this process
+        metrics.count_files(len(listfiles))
+    else:
+        results = [scan_remarks(ifile) for ifile in listfiles]
+    remarks = pd.DataFrame(results, dtype=object)
+    remarks.insert(0, 'pdbname', list(listfiles))
+    return remarks.sort_values(by=['pdbname']).reset_index(drop=True)
+
+def typed_remarks(remarks):
+    '''Convert the numeric REMARK 6 fields to float'''
+    typed = remarks.copy()
+    for name in typed.columns[1:]:
+        try:
+            typed[name] = pd.to_numeric(typed[name])
+        except (ValueError, TypeError):
+            pass
+    return typed
+
+def score_field(remarks,pattern):
+    '''Get the name of the first REMARK 6 field that contains the pattern, None if there is none'''
+    for name in remarks.columns[1:]:
+        if pattern in name:
+            return name
+    return None
+
+def missing_field(remarks,field):
+    '''Get the list of pdb files without a value for the field'''
+    if field not in remarks.columns:
+        return remarks['pdbname'].tolist()
+    return remarks.loc[remarks[field].isna(), 'pdbname'].tolist()
+
+def write_remarks(ofile,remarks):
+    '''Write the REMARK 6 table, tab separated or binary if the name ends with .npy'''
+    if score_io.is_binary(ofile):
+        score_io.write_scores(ofile, remarks)
+    else:
+        remarks.to_csv(ofile, sep='\t', index=False)
+
 def check_file_existance(ofile):
     '''check if the file file already exists'''
     try:
         f = open(ofile)
         f.close()
-        print('the ' + str(ofile) + ' already exists, exiting...')
-        sys.exit()
+        raise HMAnalysisError('the ' + str(ofile) + ' already exists, exiting...')
     except FileNotFoundError:
         print('the ' + str(ofile) + ' will be created')    
 
-def get_listoffiles(directory,name):
-    '''Get list of files and check if there are files in that directory'''
-    listdir = glob.glob(directory + '/' + str(name) +'*.pdb')
+def iter_listoffiles(directory,name):
+    '''yield the pdb files starting with name of a directory (or comma separated directories) without listing them all in memory'''
+    for pdbdir in str(directory).split(','):
+        with os.scandir(pdbdir) as entries:
+            for entry in entries:
+                if entry.name.startswith(str(name)) and entry.name.endswith('.pdb'):
+                    yield pdbdir + '/' + entry.name
+
+def get_listoffiles(directory,name,shard=None):
+    '''Get list of files, only the ones of the shard (i, N) if given, and check if there are files in that directory'''
+    listdir = iter_listoffiles(directory,name)
+    if shard is not None:
+        listdir = shard_files(listdir,shard[0],shard[1])
+    try:
+        listdir = list(listdir)
+    except FileNotFoundError:
+        listdir = []
     if len(listdir) == 0:
-        print('Cannot find files in starting with ' + str(name) + ' in the ' + str(directory) + ' directory')
-        sys.exit()
+        raise HMAnalysisError('Cannot find files in starting with ' + str(name) + ' in the ' + str(directory) + ' directory')
     return listdir
 
+def parse_shard(shard):
+    '''Get the shard number i and the number of shards N of a i/N string'''
+    try:
+        ishard, nshards = [int(value) for value in str(shard).split('/')]
+    except ValueError:
+        raise ValueError('the shard ' + str(shard) + ' is not in the i/N format')
+    if not 1 <= ishard <= nshards:
+        raise ValueError('the shard ' + str(shard) + ' must be between 1/N and N/N')
+    return ishard, nshards
+
+def shard_files(listfiles,ishard,nshards):
+    '''yield the files of the shard ishard of nshards, the shard of a file depends only on its base name'''
+    for ifile in listfiles:
+        if zlib.crc32(os.path.basename(ifile).encode()) % nshards == ishard - 1:
+            yield ifile
+
+def natural_key(name):
+    '''Sort key of a name with the numbers compared by value (i.e. B100000000 after B99999999)'''
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', str(name))]
+
+def natural_sort(df,column):
+    '''Sort a dataframe of file names by the natural order of their base names, the full path breaks ties'''
+    names = df[column].astype(str).tolist()
+    keys = [(natural_key(os.path.basename(name)), name) for name in names]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return df.iloc[order].reset_index(drop=True)
+
+def merge_scores(partials):
+    '''Combine the partial score files of the shards into one dataframe sorted by pdb name,
+    the scores of text files are kept as written'''
+    scores = pd.concat([score_io.read_scores(partial, dtype=str) for partial in partials], ignore_index=True)
+    duplicated = scores['pdbname'].duplicated()
+    if duplicated.any():
+        print(str(duplicated.sum()) + ' pdb files are in more than one partial score file, only the first score is kept')
+        scores = scores[~duplicated]
+    return natural_sort(scores,'pdbname')
+
+@exit_on_error
 def main():
     '''Main entry point'''
     args = get_parser(sys.argv[1:])
+    metrics.setup(args,'get_molpdf')
     ########### Variables ###############
     pdbdir = str(args.pdbdir)
     rootnm = str(args.rootnm)
@@ -65,16 +298,69 @@ def main():
     # Global variables
     scorepatt = str(args.pattern)
     colscore = int(args.col)
+    nproc = int(args.nproc)
+    update = args.update
+    shard = parse_shard(args.shard) if args.shard != None else None
+    if args.index != None:
+        indexfile = str(args.index)
+    else:
+        indexfile = scorefile + '.idx'
     #####################################
 
-    #check if the output file already exists
-    check_file_existance(scorefile) 
+    #check if the output file already exists, unless it will be updated
+    if not update:
+        check_file_existance(scorefile)
 
     # Find all *.pdb files in the pdbdir
-    pdblist = get_listoffiles(pdbdir,rootnm)
+    with metrics.stage('list_files'):
+        pdblist = get_listoffiles(pdbdir,rootnm,shard)
+    if shard is not None:
+        print('Shard %d/%d: %d pdb files' % (shard[0], shard[1], len(pdblist)))
+
+    if update:
+        #rescan only the new or modified files and keep the index for the next run
+        with metrics.stage('update_index'):
+            index, nscanned = update_index(read_index(indexfile,scorepatt,colscore),pdblist,scorepatt,colscore,nproc)
+            print(str(nscanned) + ' of ' + str(len(pdblist)) + ' pdb files were scanned')
+            write_index(indexfile,index,scorepatt,colscore)
+        scores = index_scores(index)
+    elif args.fields != None:
+        #one pass reads all the REMARK 6 fields, the scores are taken from the field matching the pattern
+        with metrics.stage('getremarks'):
+            remarks = getremarks(pdblist,nproc)
+        field = score_field(remarks,scorepatt)
+        missing = missing_field(remarks,field)
+        if len(missing) > 0:
+            print(str(len(missing)) + ' pdb files do not have a ' + scorepatt + ' field, their score is missing: ' + ', '.join(missing))
+        with metrics.stage('write_fields'):
+            write_remarks(str(args.fields),typed_remarks(remarks))
+        if field is None:
+            scores = pd.DataFrame({'col1': [], 'col2': []})
+        else:
+            scores = remarks.loc[remarks[field].notna(), ['pdbname', field]].set_axis(['col1', 'col2'], axis=1)
+    else:
+        with metrics.stage('getscore'):
+            scores = getscore(pdblist,scorepatt,colscore,nproc)
+
+    #print scores sorted by name with format, in the same order as the merged shards
+    with metrics.stage('write_scores'):
+        score_io.write_scores(scorefile, natural_sort(scores.rename(columns={'col1': 'pdbname', 'col2': 'molpdf'}),'pdbname'))
+
+@exit_on_error
+def merge_main():
+    '''Main entry point of merge_molpdf'''
+    args = get_merge_parser(sys.argv[1:])
+    metrics.setup(args,'merge_molpdf')
+    ########### Variables ###############
+    partials = [str(partial) for partial in args.partials]
+    scorefile = str(args.scorefile)
+    #####################################
 
-    #print scores sorted by name with format
-    np.savetxt(scorefile, getscore(pdblist,scorepatt,colscore).values, fmt='%s')
+    check_file_existance(scorefile)
+    with metrics.stage('merge'):
+        scores = merge_scores(partials)
+    with metrics.stage('write_scores'):
+        score_io.write_scores(scorefile, scores)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+import sys, os
+import time
+import json
+import atexit
+import resource
+import threading
+import contextlib
+import subprocess
+
+#stages, subprocesses and number of files read by this process
+RECORD = {'stages': [], 'subprocesses': [], 'files_read': 0}
+#serializes the updates of RECORD from the worker threads
+RECORD_LOCK = threading.Lock()
+
+def add_arguments(parser):
+    '''Add the instrumentation options to the parser of an entry point'''
+    parser.add_argument("-profile", "--profile", help="print the wall time, cpu time, memory and files read by each stage", action='store_true')
+    parser.add_argument("-metrics-json", "--metrics-json", dest="metrics_json", help="write the wall time, cpu time, memory, files read and subprocess runtimes to a json file")
+
+######### Functions ###############
+def read_bytes():
+    '''Bytes read by this process, None if /proc/self/io is not available'''
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    '''Peak resident set size in MB'''
+    maxrss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss / 1024.0 / 1024.0
+    return maxrss / 1024.0
+
+def snapshot():
+    '''Current counters of time, files and bytes read'''
+    times = os.times()
+    return {'wall_time': time.perf_counter(),
+            'cpu_time': times.user + times.system,
+            'children_cpu_time': times.children_user + times.children_system,
+            'files_read': RECORD['files_read'],
+            'bytes_read': read_bytes()}
+
+def delta(start,end):
+    '''Difference of two snapshots'''
+    diff = {}
+    for key in start:
+        if start[key] is None or end[key] is None:
+            diff[key] = None
+        else:
+            diff[key] = end[key] - start[key]
+    return diff
+
+START = snapshot()
+
+@contextlib.contextmanager
+def stage(name):
+    '''Record the time, memory and files read by the code run in the with block'''
+    start = snapshot()
+    try:
+        yield
+    finally:
+        entry = {'name': name}
+        entry.update(delta(start, snapshot()))
+        entry['peak_rss_mb'] = peak_rss_mb()
+        with RECORD_LOCK:
+            RECORD['stages'].append(entry)
+
+def count_files(nfiles=1):
+    '''Add nfiles to the number of files read'''
+    with RECORD_LOCK:
+        RECORD['files_read'] += nfiles
+
+def run_subprocess(name,cmd,**kwargs):
+    '''subprocess.run that records the runtime and return code of the command'''
+    start = time.perf_counter()
+    returncode = 'timeout'
+    try:
+        result = subprocess.run(cmd, **kwargs)
+        returncode = result.returncode
+        return result
+    finally:
+        with RECORD_LOCK:
+            RECORD['subprocesses'].append({'name': name, 'cmd': [str(arg) for arg in cmd],
+                                           'wall_time': time.perf_counter() - start, 'returncode': returncode})
+
+def summary(entry_point):
+    '''Totals, stages and subprocesses recorded since the module was loaded'''
+    data = {'entry_point': entry_point, 'argv': sys.argv[1:]}
+    data.update(delta(START, snapshot()))
+    data['peak_rss_mb'] = peak_rss_mb()
+    data['children_peak_rss_mb'] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    with RECORD_LOCK:
+        data['stages'] = list(RECORD['stages'])
+        data['subprocesses'] = list(RECORD['subprocesses'])
+    return data
+
+def report(entry_point,profile=False,jsonfile=None):
+    '''Print the summary and/or write it to a json file'''
+    data = summary(entry_point)
+    if jsonfile is not None:
+        with open(jsonfile, 'w') as f:
+            json.dump(data, f, indent=1)
+    if profile:
+        print('%-24s %10s %10s %10s %8s %12s' % ('stage', 'wall (s)', 'cpu (s)', 'rss (MB)', 'files', 'bytes'))
+        for entry in data['stages'] + [dict(data, name='total')]:
+            print('%-24s %10.3f %10.3f %10.1f %8d %12s' % (entry['name'], entry['wall_time'], entry['cpu_time'] + entry['children_cpu_time'],
+                                                         entry['peak_rss_mb'], entry['files_read'], entry['bytes_read']))
+        if len(data['subprocesses']) > 0:
+            runtimes = {}
+            for entry in data['subprocesses']:
+                runtimes.setdefault(entry['name'], []).append(entry['wall_time'])
+            for name, times in sorted(runtimes.items()):
+                print('%-24s %d runs, %.3f s total, %.3f s max' % (name, len(times), sum(times), max(times)))
+    return data
+
+def setup(args,entry_point):
+    '''Report the metrics when the entry point exits if --profile or --metrics-json were given'''
+    if args.profile or args.metrics_json != None:
+        jsonfile = str(args.metrics_json) if args.metrics_json != None else None
+        atexit.register(report, entry_point, args.profile, jsonfile)
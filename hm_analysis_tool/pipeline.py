@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+import sys, os
+import argparse
+import numpy as np
+from hm_analysis_tool import score_io
+from hm_analysis_tool import check_molpdf_conv
+from hm_analysis_tool import extract_str
+from hm_analysis_tool import compute_proqm
+from hm_analysis_tool import cluster_str
+from hm_analysis_tool import metrics
+from hm_analysis_tool.errors import HMAnalysisError, exit_on_error
+
+def get_parser(args):
+    '''Define inputs by the user from the command line'''
+    ########## Input/output and options from user ###
+    parser = argparse.ArgumentParser(description = 'Script that runs get_molpdf, check_molpdf_conv, extract_str and (optionally) cluster_str and compute_proqm in one process, reading the pdb files once and keeping the scores in memory')
+    parser.add_argument("-pdbdir", help="directory of the input pdb file(s)", required=True)
+    parser.add_argument("-rootname", help="specify rootname of the pdb files (i.e. gly1.B)", dest="rootnm", required=True)
+    parser.add_argument("-pattern", help="pattern in pdb file to search for score, (default='MODELLER OBJECTIVE FUNCTION')", default='MODELLER OBJECTIVE FUNCTION')
+    parser.add_argument("-col", help="column of MOLPDF score value in matched line of pdb (default=5)", default='5')
+    parser.add_argument("-nproc", help="number of worker processes/threads of each stage (default=1)", default='1')
+    parser.add_argument("-o", dest="scorefile", help="optional output score file, written in binary if it ends with .npy")
+    parser.add_argument("-win", help="windows size for computing score RMSD, a comma separated list computes one RMSD column per window (default: 200)", default='200')
+    parser.add_argument("-outrms" , help="optional output score RMSD file")
+    parser.add_argument("-ofig", help="optional output pdf figure of the convergence")
+    parser.add_argument('-percent', dest="perc", help="percentage of lowest MOLPDF score to extract")
+    parser.add_argument('-threshold', dest="thres", help="MOLPDF score threshold of the models to extract")
+    parser.add_argument("-outdir", help="folder to write extracted pdb files", required=True)
+    parser.add_argument("-link-mode", dest="link_mode", choices=extract_str.LINK_MODES, help="how to place the pdb files in outdir (default: copy)", default='copy')
+    parser.add_argument("-cluster_cutoff", help="if given the extracted models are clustered by CA RMSD with this cutoff in Angstrom, written to <outdir>/clusters.txt")
+    parser.add_argument("-tmpldir", help="directory of the template, if given the ProQM score of the extracted models is computed")
+    parser.add_argument("-alignment_pir", help="full path to the alignment modeller PIR file between target and template, required with -tmpldir")
+    parser.add_argument("-rosetta_score_app", help="Rosetta score application (default: " + compute_proqm.ROSETTA_SCORE_APP + ")", default=compute_proqm.ROSETTA_SCORE_APP)
+    parser.add_argument("-proqm_script", help="ProQ master script bin folder (default: " + compute_proqm.PROQM_SCRIPT + ")", default=compute_proqm.PROQM_SCRIPT)
+    parser.add_argument("-rosetta_db", help="Rosetta database folder (default: " + compute_proqm.ROSETTA_DB + ")", default=compute_proqm.ROSETTA_DB)
+    parser.add_argument("-batch", help="number of models scored by each Rosetta score process (default: 1)", default='1')
+    metrics.add_arguments(parser)
+    args = parser.parse_args(args)
+    if args.perc == None and args.thres == None:
+        parser.error('one of the arguments -percent -threshold is required')
+    if args.tmpldir != None and args.alignment_pir == None:
+        parser.error('the argument -alignment_pir is required with -tmpldir')
+    return args
+
+######### Functions ###############
+
+class Pipeline:
+    '''Analysis of a set of MODELLER models in one process, the pdb files are read once and the scores kept in memory'''
+    def __init__(self, pdbdir, rootnm, pattern='MODELLER OBJECTIVE FUNCTION', col=5, nproc=1):
+        self.pdbdir = pdbdir
+        self.rootnm = rootnm
+        self.pattern = pattern
+        self.col = col
+        self.nproc = nproc
+        self.scores = None
+        self.sortscorelist = None
+        self.rmslist = None
+        self.selected = None
+        self.perc = None
+        self.thres = None
+        self.outdir = None
+        self.models = None
+
+    def scan(self):
+        '''Get the scores of the pdb files, sorted by file name'''
+        self.scores = extract_str.scan_scores(self.pdbdir,self.rootnm,self.pattern,self.col,self.nproc)
+        return self.scores
+
+    def check_scanned(self):
+        '''check if the pdb files were scanned'''
+        if self.scores is None:
+            raise HMAnalysisError('The pdb files have not been scanned yet, run scan first')
+
+    def convergence(self, windows=[200]):
+        '''Compute the windows rms of the sorted scores for each window size'''
+        self.check_scanned()
+        scorelist = self.scores['molpdf'].to_numpy(dtype=float)
+        check_molpdf_conv.check_numdls(scorelist,max(windows))
+        self.sortscorelist = -np.sort(-scorelist)
+        self.rmslist = check_molpdf_conv.winrms_multi(self.sortscorelist,windows)
+        return self.rmslist
+
+    def select(self, perc=None, thres=None):
+        '''Select the lowest score perc % of the models and/or the models below thres'''
+        self.check_scanned()
+        if perc is None and thres is None:
+            raise HMAnalysisError('A percentage or a threshold is needed to select the models')
+        selected = self.scores
+        if perc is not None:
+            selected = extract_str.select_best_perc(selected,perc)
+        if thres is not None:
+            selected = extract_str.select_underthres(selected,thres)
+        self.perc = perc
+        self.thres = thres
+        self.selected = selected
+        return selected
+
+    def extract(self, outdir, link_mode='copy'):
+        '''Place the selected models in outdir and write its log file'''
+        if self.selected is None:
+            raise HMAnalysisError('No models have been selected yet, run select first')
+        list_pdb = self.selected['pdbname'].values.tolist()
+        extract_str.create_outdir(outdir,list_pdb,link_mode,self.nproc)
+        num_mdls = len(list_pdb)
+        xtx_score = (self.selected.tail(1)['molpdf'].values.tolist() or [float('nan')])[0]
+        if self.perc is not None and self.thres is not None:
+            extract_str.print_log_perc_thr(outdir,self.perc,self.thres,xtx_score,num_mdls)
+        elif self.perc is not None:
+            extract_str.print_log_perc(outdir,self.perc,xtx_score,num_mdls)
+        else:
+            extract_str.print_log_thr(outdir,self.thres,num_mdls)
+        self.outdir = os.path.join(os.getcwd(), outdir)
+        self.models = [os.path.join(self.outdir, os.path.basename(pdb)) for pdb in list_pdb]
+        return self.models
+
+    def cluster(self, cutoff=2.0, names=['CA'], batch=1024):
+        '''Cluster the extracted models by RMSD, the coordinates are cached next to the output folder.
+        Return the cluster of each model and the cluster centers'''
+        if self.models is None:
+            raise HMAnalysisError('No models have been extracted yet, run extract first')
+        coords, atoms = cluster_str.load_store(self.outdir,self.models,self.nproc)
+        matrix = cluster_str.rmsd_matrix(cluster_str.store_paths(self.outdir)[0],cluster_str.atom_indices(atoms,names),self.nproc,batch)
+        return cluster_str.cluster_rmsd(matrix,cutoff)
+
+    def proqm(self, tmpldir, alignment_pir, **kwargs):
+        '''Compute the PROQM score of the template and the extracted models in the output folder,
+        kwargs are passed to compute_proqm.run_proqm. Return the list of models that could not be scored'''
+        if self.models is None:
+            raise HMAnalysisError('No models have been extracted yet, run extract first')
+        for fasta in ('fasta_mdl', 'fasta_template'):
+            if kwargs.get(fasta):
+                kwargs[fasta] = os.path.abspath(kwargs[fasta])
+        cwd = os.getcwd()
+        os.chdir(self.outdir)
+        try:
+            return compute_proqm.run_proqm(os.path.abspath(os.path.join(cwd, tmpldir)),os.path.abspath(os.path.join(cwd, alignment_pir)),mdls_pdblist=self.models,nproc=self.nproc,**kwargs)
+        finally:
+            os.chdir(cwd)
+
+    def write_scores(self, scorefile):
+        '''Write the scores to a text or binary score file'''
+        self.check_scanned()
+        score_io.write_scores(scorefile,self.scores)
+
+@exit_on_error
+def main():
+    '''Main entry point'''
+    args = get_parser(sys.argv[1:])
+    metrics.setup(args,'hm_pipeline')
+    ########### Variables ###############
+    pdbdir = str(args.pdbdir)
+    rootnm = str(args.rootnm)
+    outdir = str(args.outdir)
+    link_mode = str(args.link_mode)
+    # Global variables
+    scorepatt = str(args.pattern)
+    colscore = int(args.col)
+    nproc = int(args.nproc)
+    windows = check_molpdf_conv.parse_windows(args.win)
+    perc = int(args.perc) if args.perc != None else None
+    thres = int(args.thres) if args.thres != None else None
+    #####################################
+
+    pipeline = Pipeline(pdbdir,rootnm,scorepatt,colscore,nproc)
+    with metrics.stage('scan'):
+        pipeline.scan()
+    if args.scorefile != None:
+        with metrics.stage('write_scores'):
+            pipeline.write_scores(str(args.scorefile))
+
+    #the convergence is only informative, it is skipped if there are not enough models
+    if check_molpdf_conv.enough_mdls(pipeline.scores,max(windows)):
+        with metrics.stage('convergence'):
+            rmslist = pipeline.convergence(windows)
+        if args.outrms != None:
+            with open(str(args.outrms), 'w+') as datafile_id:
+                np.savetxt(datafile_id, check_molpdf_conv.rms_columns(rmslist), fmt='%1.4f')
+        if args.ofig != None:
+            with metrics.stage('plot'):
+                check_molpdf_conv.plot_opt(pipeline.scores['molpdf'].to_numpy(dtype=float),pipeline.sortscorelist,rmslist,str(args.ofig),windows)
+    else:
+        print('The total number of models, ' + str(len(pipeline.scores)) + ', is too little compared with the RMSD windows size, ' + str(max(windows)) + '. The convergence is skipped.')
+
+    with metrics.stage('select'):
+        pipeline.select(perc,thres)
+    with metrics.stage('extract'):
+        pipeline.extract(outdir,link_mode)
+
+    if args.cluster_cutoff != None:
+        with metrics.stage('cluster'):
+            labels, centers = pipeline.cluster(float(args.cluster_cutoff))
+        cluster_str.print_clusters(os.path.join(outdir, 'clusters.txt'),pipeline.models,labels,centers)
+
+    if args.tmpldir != None:
+        with metrics.stage('proqm'):
+            pipeline.proqm(str(args.tmpldir),str(args.alignment_pir),rosetta_score_app=str(args.rosetta_score_app),
+                           proqm_script=str(args.proqm_script),rosetta_db=str(args.rosetta_db),batch=int(args.batch))
+
+if __name__ == '__main__':
+    main()
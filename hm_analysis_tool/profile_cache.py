@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+import os
+import glob
+import shutil
+import hashlib
+
+#default root of the ProQM profile cache
+CACHE_ROOT = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'hm_analysis_tool', 'proqm_profiles')
+#settings of run_all_external.pl that change the profile, they are part of the cache key
+PROFILE_SETTINGS = '-membrane 1'
+
+THREE_TO_ONE = {'ALA':'A', 'ARG':'R', 'ASN':'N', 'ASP':'D', 'CYS':'C', 'GLN':'Q', 'GLU':'E', 'GLY':'G',
+                'HIS':'H', 'HSD':'H', 'HSE':'H', 'HSP':'H', 'ILE':'I', 'LEU':'L', 'LYS':'K', 'MET':'M',
+                'MSE':'M', 'PHE':'F', 'PRO':'P', 'SER':'S', 'THR':'T', 'TRP':'W', 'TYR':'Y', 'VAL':'V'}
+
+######### Functions ###############
+def pdb_sequence(fpdb):
+    '''Get the one letter sequence of the ATOM records of a pdb file, chains are separated by /'''
+    chains = {}
+    seen = set()
+    with open(fpdb) as f:
+        for line in f:
+            if not line.startswith('ATOM'):
+                continue
+            residue = (line[21], line[22:27])
+            if residue in seen:
+                continue
+            seen.add(residue)
+            chains.setdefault(line[21], []).append(THREE_TO_ONE.get(line[17:20].strip(), 'X'))
+    return '/'.join(''.join(seq) for seq in chains.values())
+
+def fasta_sequence(fasta):
+    '''Get the sequence of a fasta file without the header and white spaces'''
+    with open(fasta) as f:
+        return ''.join(line.strip() for line in f if not line.startswith('>'))
+
+def profile_key(fpdb,fullseq=''):
+    '''Hash of the pdb sequence, the full sequence (if any) and the profile settings'''
+    key = [PROFILE_SETTINGS, pdb_sequence(fpdb)]
+    if os.path.isfile(fullseq):
+        key.append(fasta_sequence(fullseq))
+    return hashlib.sha256('\n'.join(key).encode()).hexdigest()
+
+def cache_restore(cache_root,key,fpdb):
+    '''Copy the cached profile files to fpdb.*, return False if the profile is not cached'''
+    entry = os.path.join(cache_root, key)
+    if not os.path.isdir(entry):
+        return False
+    for ifile in sorted(os.listdir(entry)):
+        shutil.copy(os.path.join(entry, ifile), str(fpdb) + ifile)
+    #the modification time of the entry is used to evict the least recently used profiles
+    os.utime(entry)
+    return True
+
+def cache_store(cache_root,key,fpdb):
+    '''Copy the profile files fpdb.* to the cache'''
+    entry = os.path.join(cache_root, key)
+    tmp_entry = entry + '.tmp' + str(os.getpid())
+    os.makedirs(tmp_entry, exist_ok=True)
+    for ifile in glob.glob(glob.escape(str(fpdb)) + '.*'):
+        shutil.copy(ifile, os.path.join(tmp_entry, ifile[len(str(fpdb)):]))
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        #another run stored the same profile first
+        shutil.rmtree(tmp_entry)
+
+def entry_size(entry):
+    '''Size in bytes of the files of a cache entry'''
+    return sum(os.path.getsize(os.path.join(entry, ifile)) for ifile in os.listdir(entry))
+
+def cache_evict(cache_root,max_size):
+    '''Remove the least recently used profiles until the cache is smaller than max_size bytes'''
+    entries = [os.path.join(cache_root, key) for key in os.listdir(cache_root)]
+    entries = sorted((entry for entry in entries if os.path.isdir(entry)), key=os.path.getmtime)
+    sizes = [entry_size(entry) for entry in entries]
+    total = sum(sizes)
+    for entry, size in zip(entries, sizes):
+        if total <= max_size:
+            break
+        shutil.rmtree(entry)
+        total -= size
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+import sys, os
+import argparse
+import glob
+import numpy as np
+from hm_analysis_tool import compute_proqm
+from hm_analysis_tool import check_molpdf_conv
+from hm_analysis_tool import metrics
+from hm_analysis_tool.errors import HMAnalysisError, exit_on_error
+
+#alignment characters that are not residues of the ProQM local prediction (gaps, chain breaks and BLK residues)
+NOT_RESIDUES = '-/.*'
+
+def get_parser(args):
+    '''Define inputs by the user from the command line'''
+    ########## Input/output and options from user ###
+    parser = argparse.ArgumentParser(description = 'Per-residue ProQM score of the models compared with the template, read from the local predictions written by compute_proqm. Template name and rootname of models will be read from the alignment file')
+    parser.add_argument("-alignment_pir", help="full path to the alignment modeller PIR file between target and template", required=True)
+    parser.add_argument("-localdir", help="directory of the local prediction files (default: working directory)", default='.')
+    parser.add_argument("-local_glob", help="glob pattern of the local prediction files after the template/model rootname (default: *local*)", default='*local*')
+    parser.add_argument("-o", dest="report", help="output per-residue report (default: proqm_local.txt)", default='proqm_local.txt')
+    parser.add_argument("-ofig", help="output pdf figure of the per-residue ProQM score")
+    parser.add_argument("-mmap", help="binary .npy file used to store the models x residues matrix memory-mapped")
+    metrics.add_arguments(parser)
+    return parser.parse_args(args)
+
+######### Functions ###############
+
+def read_local_prediction(ifile):
+    '''Get the per-residue scores of a local prediction file, either one residue per line (score in the last column) or all residues in one line'''
+    rows = []
+    with open(ifile) as f:
+        for line in f:
+            data = line.split()
+            try:
+                rows.append([float(value) for value in data])
+            except ValueError:
+                #residue lines with text columns (i.e. number, residue name and score)
+                try:
+                    rows.append([float(data[-1])])
+                except ValueError:
+                    continue
+    rows = [row for row in rows if len(row) > 0]
+    if len(rows) == 1:
+        return np.array(rows[0])
+    return np.array([row[-1] for row in rows])
+
+def load_local_matrix(files,mmapfile=None):
+    '''Get the models x residues matrix of the local predictions, memory-mapped in mmapfile if given.
+    The number of residues is the one of the first file, shorter predictions are padded with nan'''
+    metrics.count_files(len(files))
+    first = read_local_prediction(files[0])
+    shape = (len(files), len(first))
+    if mmapfile is not None:
+        matrix = np.lib.format.open_memmap(mmapfile, mode='w+', dtype=np.float64, shape=shape)
+    else:
+        matrix = np.empty(shape)
+    matrix[:] = np.nan
+    for i, ifile in enumerate(files):
+        values = first if i == 0 else read_local_prediction(ifile)
+        if len(values) != shape[1]:
+            print('The local prediction ' + str(ifile) + ' has ' + str(len(values)) + ' residues instead of ' + str(shape[1]))
+        values = values[:shape[1]]
+        matrix[i, :len(values)] = values
+    if mmapfile is not None:
+        matrix.flush()
+    return matrix
+
+def alignment_map(target_aln,template_aln):
+    '''Get the index of the template residue aligned to each target residue, -1 if it is aligned to a gap'''
+    target = np.array(list(target_aln))
+    template = np.array(list(template_aln))
+    target_res = ~np.isin(target, list(NOT_RESIDUES))
+    template_res = ~np.isin(template, list(NOT_RESIDUES))
+    template_idx = np.cumsum(template_res) - 1
+    mapped = np.where(template_res, template_idx, -1)
+    return mapped[target_res], target[target_res]
+
+def residue_stats(matrix,template,resmap):
+    '''Per-residue mean and standard deviation of the models, template score on the target residues and difference'''
+    nres = min(matrix.shape[1], len(resmap))
+    resmap = resmap[:nres]
+    mean = np.nanmean(matrix[:, :nres], axis=0)
+    std = np.nanstd(matrix[:, :nres], axis=0)
+    valid = (resmap >= 0) & (resmap < len(template))
+    on_target = np.full(nres, np.nan)
+    on_target[valid] = template[resmap[valid]]
+    return {'mean': mean, 'std': std, 'template': on_target, 'diff': mean - on_target}
+
+def print_report(ofile,stats,residues):
+    '''Print the per-residue statistics'''
+    nres = len(stats['mean'])
+    with open(ofile, 'w') as f:
+        f.write('#residue aa mean std template diff\n')
+        for i in range(nres):
+            f.write('%d %s %.4f %.4f %.4f %.4f\n' % (i + 1, residues[i], stats['mean'][i], stats['std'][i], stats['template'][i], stats['diff'][i]))
+
+def plot_local(stats,ofig):
+    '''Plot the per-residue ProQM score of the models and the template, and their difference'''
+    plt = check_molpdf_conv.load_pyplot()
+    resnum = np.arange(1, len(stats['mean']) + 1)
+    fig = plt.figure(figsize=(10,6))
+    axis1 = fig.add_subplot(211)
+    axis1.fill_between(resnum, stats['mean'] - stats['std'], stats['mean'] + stats['std'], alpha=0.3, label='models (mean +/- std)')
+    axis1.plot(resnum, stats['mean'])
+    axis1.plot(resnum, stats['template'], label='template')
+    axis1.set_ylabel('ProQM score')
+    axis1.legend()
+    axis2 = fig.add_subplot(212)
+    axis2.plot(resnum, stats['diff'])
+    axis2.axhline(0, color='grey', linewidth=0.5)
+    axis2.set_ylabel('models - template')
+    axis2.set_xlabel('target residue')
+    fig.savefig(ofig)
+    plt.close(fig)
+
+def get_local_files(localdir,name,local_glob):
+    '''Get the sorted list of local prediction files of a rootname'''
+    files = sorted(glob.glob(os.path.join(localdir, glob.escape(str(name)) + local_glob)))
+    if len(files) == 0:
+        raise HMAnalysisError('Cannot find local prediction files starting with ' + str(name) + ' in the ' + str(localdir) + ' directory')
+    return files
+
+@exit_on_error
+def main():
+    '''Main entry point'''
+    args = get_parser(sys.argv[1:])
+    metrics.setup(args,'proqm_local')
+    ########### Variables ###############
+    alignment_pir = str(args.alignment_pir)
+    localdir = str(args.localdir)
+    local_glob = str(args.local_glob)
+    report = str(args.report)
+    mmapfile = str(args.mmap) if args.mmap != None else None
+    #####################################
+
+    entries = compute_proqm.read_pir(alignment_pir)
+    template_name, template_aln = entries['structure']
+    mdls_rootnm, target_aln = entries['sequence']
+    resmap, residues = alignment_map(target_aln,template_aln)
+
+    with metrics.stage('load_local'):
+        template = read_local_prediction(get_local_files(localdir,template_name,local_glob)[0])
+        matrix = load_local_matrix(get_local_files(localdir,mdls_rootnm,local_glob),mmapfile)
+    print('Read the local prediction of ' + str(matrix.shape[0]) + ' models with ' + str(matrix.shape[1]) + ' residues')
+
+    with metrics.stage('residue_stats'):
+        stats = residue_stats(matrix,template,resmap)
+    print_report(report,stats,residues)
+    if args.ofig != None:
+        with metrics.stage('plot'):
+            plot_local(stats,str(args.ofig))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+import sys, os
+import argparse
+import numpy as np
+import pandas as pd
+from hm_analysis_tool import metrics
+
+#extension of the binary score files, any other extension is read/written as text
+BINARY_EXT = '.npy'
+#default column names of a score file (i.e. format pdbfile score)
+SCORE_COLUMNS = ['pdbname', 'molpdf']
+
+def get_parser(args):
+    '''Define inputs by the user from the command line'''
+    ########## Input/output and options from user ###
+    parser = argparse.ArgumentParser(description = 'Script to convert a score file between the text and the binary (' + BINARY_EXT + ') formats')
+    parser.add_argument("-i", dest="infile", help="input score file", required=True)
+    parser.add_argument("-o", dest="outfile", help="output score file, written in binary if it ends with " + BINARY_EXT, required=True)
+    metrics.add_arguments(parser)
+    return parser.parse_args(args)
+
+######### Functions ###############
+def is_binary(scorefile):
+    '''check if the score file is in the binary format'''
+    return str(scorefile).endswith(BINARY_EXT)
+
+def encode_names(values):
+    '''Store text values as bytes, ASCII or UTF-8 if they have other characters'''
+    try:
+        return values.to_numpy(dtype=str).astype('S')
+    except UnicodeEncodeError:
+        return values.str.encode('utf-8').to_numpy(dtype='S')
+
+def decode_names(values):
+    '''Get the text values of a bytes column'''
+    try:
+        return values.astype(str)
+    except UnicodeDecodeError:
+        return pd.Series(values).str.decode('utf-8').to_numpy()
+
+def to_records(df):
+    '''Convert a score dataframe to a numpy structured array, numeric columns are stored as float and text columns as bytes'''
+    fields = []
+    for name in df.columns:
+        try:
+            values = pd.to_numeric(df[name]).to_numpy(dtype=np.float64)
+        except (ValueError, TypeError):
+            values = encode_names(df[name].astype(str))
+        fields.append((str(name), values))
+    records = np.empty(len(df), dtype=[(name, values.dtype) for name, values in fields])
+    for name, values in fields:
+        records[name] = values
+    return records
+
+def write_scores(scorefile,df):
+    '''Write a score dataframe to a text file or, if the name ends with .npy, to a binary file.
+    The file is written to a temporary file and renamed, so readers never see a partly written file'''
+    tmpfile = str(scorefile) + '.tmp' + str(os.getpid())
+    if is_binary(scorefile):
+        with open(tmpfile, 'wb') as f:
+            np.save(f, to_records(df), allow_pickle=False)
+    else:
+        with open(tmpfile, 'w') as f:
+            np.savetxt(f, df.values, fmt='%s')
+    os.replace(tmpfile, scorefile)
+
+def load_records(scorefile):
+    '''Memory-map the structured array of a binary score file'''
+    return np.load(scorefile, mmap_mode='r', allow_pickle=False)
+
+def read_scores(scorefile,names=SCORE_COLUMNS,dtype=None):
+    '''Read a text or binary score file into a dataframe, dtype is used for the columns of text files'''
+    metrics.count_files()
+    if is_binary(scorefile):
+        records = load_records(scorefile)
+        #text columns are stored as bytes, older files store them as unicode
+        return pd.DataFrame({name: decode_names(records[name]) if records.dtype[name].kind == 'S' else records[name] for name in records.dtype.names})
+    return pd.read_csv(scorefile, sep=r'\s+', names=names, header=None, dtype=dtype)
+
+def read_column(scorefile,col):
+    '''Get the column #col of a binary score file as a float array'''
+    metrics.count_files()
+    records = load_records(scorefile)
+    return np.asarray(records[records.dtype.names[col]], dtype=np.float64)
+
+def main():
+    '''Main entry point'''
+    args = get_parser(sys.argv[1:])
+    metrics.setup(args,'convert_scores')
+    ########### Variables ###############
+    infile = str(args.infile)
+    outfile = str(args.outfile)
+    #####################################
+
+    write_scores(outfile, read_scores(infile))
+
+if __name__ == '__main__':
+    main()
@@ -13,9 +13,14 @@ setup(name='hm_analysis_tool',
       entry_points={
           'console_scripts': [
               'get_molpdf = hm_analysis_tool.get_molpdf:main',
+              'merge_molpdf = hm_analysis_tool.get_molpdf:merge_main',
               'check_molpdf_conv = hm_analysis_tool.check_molpdf_conv:main',
               'extract_str = hm_analysis_tool.extract_str:main',
-              'compute_proqm = hm_analysis_tool.compute_proqm:main'
+              'compute_proqm = hm_analysis_tool.compute_proqm:main',
+              'convert_scores = hm_analysis_tool.score_io:main',
+              'hm_pipeline = hm_analysis_tool.pipeline:main',
+              'proqm_local = hm_analysis_tool.proqm_local:main',
+              'cluster_str = hm_analysis_tool.cluster_str:main'
           ]
       },
       )
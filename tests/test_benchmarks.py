@@ -0,0 +1,20 @@
+from benchmarks import bench_ensembles
+from hm_analysis_tool import get_molpdf
+import pytest
+
+def test_bench_scale(tmp_path):
+    '''Test if the benchmarks run on a small synthetic ensemble'''
+    seeds = bench_ensembles.read_seeds(bench_ensembles.SEED_DIR,20)
+    assert len(seeds) == 99
+    results = bench_ensembles.bench_scale(seeds,str(tmp_path),200,gz=True)
+    results.update(bench_ensembles.bench_clean(seeds,str(tmp_path),5))
+    assert sorted(results) == ['col2list_winrms@200', 'get_best_perc_create_outdir@200', 'getscore@200', 'getscore_gz@200', 'print_clean_pdb@5']
+    assert bench_ensembles.compare(results,results,1.25,1.25) == []
+    slow = {name: {'time': result['time'] / 2, 'peak_mb': result['peak_mb']} for name, result in results.items()}
+    assert len(bench_ensembles.compare(results,slow,1.25,1.25)) > 0
+
+def test_make_ensemble(tmp_path):
+    '''Test if every synthetic model has a MODELLER objective function REMARK'''
+    seeds = bench_ensembles.read_seeds(bench_ensembles.SEED_DIR,20)
+    files = bench_ensembles.make_ensemble(seeds,str(tmp_path),200)
+    assert len(get_molpdf.getscore(files,bench_ensembles.SCORE_PATTERN,5)) == 200
@@ -1,5 +1,7 @@
 from hm_analysis_tool import check_molpdf_conv
 import pytest
+import numpy as np
+import sys
 
 def test_parser_not_default():
     '''Test if parser reads if all not default options are passed'''
@@ -16,3 +18,85 @@ def test_parser_allopt():
     assert args.ofig == 'test-case/analysis/score-conv.pdf'
     assert args.win == '200'
     assert args.scorecol == '1'
+
+def test_winrms_convolve():
+    '''Test if the windows rms matches the rms computed with a convolution'''
+    scores = np.random.default_rng(0).uniform(2000, 3000, 1000)
+    for win in [1, 50, 200]:
+        check = np.sqrt(np.convolve(np.power(scores,2), np.ones(win)/float(win), 'valid'))
+        assert np.allclose(check_molpdf_conv.winrms(scores,win), check)
+
+def test_winrms_multi():
+    '''Test if several window sizes are computed in one pass and written as columns'''
+    scores = np.random.default_rng(0).uniform(2000, 3000, 1000)
+    rmslist = check_molpdf_conv.winrms_multi(scores, check_molpdf_conv.parse_windows('50,200'))
+    columns = check_molpdf_conv.rms_columns(rmslist)
+    assert columns.shape == (951, 2)
+    assert np.allclose(columns[:801, 1], check_molpdf_conv.winrms(scores,200))
+    assert np.isnan(columns[801:, 1]).all()
+
+def test_convergence_watch():
+    '''Test if the incrementally updated windows rms matches the one computed from all the scores'''
+    scores = np.random.default_rng(0).uniform(2000, 3000, 1000)
+    conv = check_molpdf_conv.ConvergenceWatch([10, 50], 0.001)
+    for batch in np.array_split(scores, 7):
+        conv.add(batch)
+    sortscorelist = -np.sort(-scores)
+    assert np.array_equal(conv.sortscorelist, sortscorelist)
+    assert np.allclose(conv.rmslist[0], check_molpdf_conv.winrms(sortscorelist,10))
+    assert np.allclose(conv.rmslist[1], check_molpdf_conv.winrms(sortscorelist,50))
+    assert conv.converged() == all(change < 0.001 for change in conv.change)
+
+def test_convergence_watch_constant():
+    '''Test if identical scores (zero rms) are converged instead of dividing by zero'''
+    conv = check_molpdf_conv.ConvergenceWatch([10], 0.001)
+    conv.add(np.full(60, 2500.0))
+    conv.add(np.full(10, 2500.0))
+    assert conv.change == [0.0]
+    assert conv.converged()
+
+def test_watch_stops(capsys):
+    '''Test if watch judges a complete ensemble in one check and stops when no new models arrive'''
+    scores = np.random.default_rng(0).uniform(2000, 3000, 1000).tolist()
+    polls = [scores]
+    conv = check_molpdf_conv.watch(lambda: polls.pop() if polls else [],[10],0.0,0,max_idle=3)
+    assert len(conv.scorelist) == 1000
+    assert np.isfinite(conv.change[0])
+    assert not conv.converged()
+    assert 'NOT CONVERGED' in capsys.readouterr().out
+    polls = [scores]
+    conv = check_molpdf_conv.watch(lambda: polls.pop() if polls else [],[10],1.0,0,max_idle=3)
+    assert conv.converged()
+
+@pytest.mark.parametrize('tol,status', [('1.0', None), ('0.0', check_molpdf_conv.NOT_CONVERGED_STATUS)])
+def test_main_watch_status(tmp_path,monkeypatch,tol,status):
+    '''Test if -watch exits with a nonzero status only when the scores did not converge'''
+    scorefile = tmp_path / 'molpdf.txt'
+    scores = np.random.default_rng(0).uniform(2000, 3000, 100)
+    scorefile.write_text(''.join('glyt1.B9999%04d.pdb %.4f\n' % (i, score) for i, score in enumerate(scores)))
+    monkeypatch.setattr(sys, 'argv', ['check_molpdf_conv', '-watch', '-scorefile', str(scorefile), '-outrms', str(tmp_path / 'conv.out'),
+                                      '-win', '10', '-tol', tol, '-interval', '0', '-max_idle', '2', '-no-plot'])
+    if status is None:
+        check_molpdf_conv.main()
+    else:
+        with pytest.raises(SystemExit) as error:
+            check_molpdf_conv.main()
+        assert error.value.code == status
+
+def test_poll_scorefile(tmp_path):
+    '''Test if only the new models of a growing score file are returned'''
+    scorefile = tmp_path / 'molpdf.txt'
+    seen = set()
+    scorefile.write_text('glyt1.B99990001.pdb 2386.0759\n')
+    assert check_molpdf_conv.poll_scorefile(str(scorefile),1,seen) == [2386.0759]
+    scorefile.write_text('glyt1.B99990001.pdb 2386.0759\nglyt1.B99990002.pdb 2607.5806\n')
+    assert check_molpdf_conv.poll_scorefile(str(scorefile),1,seen) == [2607.5806]
+
+def test_minmax_downsample():
+    '''Test if the downsampled curve is bounded and keeps the extreme values'''
+    scores = np.random.default_rng(0).uniform(2000, 3000, 100000)
+    idx, values = check_molpdf_conv.minmax_downsample(scores, 2000)
+    assert len(values) <= 2000
+    assert np.all(np.diff(idx) > 0)
+    assert values.min() == scores.min()
+    assert values.max() == scores.max()
@@ -0,0 +1,91 @@
+from hm_analysis_tool import cluster_str
+from hm_analysis_tool.errors import HMAnalysisError
+import numpy as np
+import pytest
+import os
+import sys
+import shutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def outdir(tmp_path):
+    '''Folder with a few of the glyt1 models, as written by extract_str'''
+    odir = tmp_path / 'best'
+    odir.mkdir()
+    for i in range(1, 7):
+        shutil.copy(ROOT + '/test-case/glyt1/glyt1.B9999%04d.pdb' % i, str(odir))
+    return str(odir)
+
+def kabsch_rmsd(ref,mobile):
+    '''Reference RMSD computed with the explicit rotation matrix'''
+    ref = ref - ref.mean(axis=0)
+    mobile = mobile - mobile.mean(axis=0)
+    u, s, vt = np.linalg.svd(mobile.T @ ref)
+    d = np.sign(np.linalg.det(u @ vt))
+    rot = u @ np.diag([1, 1, d]) @ vt
+    return np.sqrt(((mobile @ rot - ref) ** 2).sum() / len(ref))
+
+def test_superposed_rmsd():
+    '''The batched RMSD is invariant to rotations and translations and matches the explicit superposition'''
+    rng = np.random.default_rng(0)
+    ref = rng.normal(size=(50, 3))
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    rotated = ref @ (q * np.sign(np.linalg.det(q))) + 5.0
+    noisy = [ref + rng.normal(scale=0.5, size=ref.shape) for i in range(3)]
+    batch = cluster_str.center(np.array([rotated] + noisy))
+    rmsd = cluster_str.superposed_rmsd(cluster_str.center(ref), batch)
+    assert rmsd[0] == pytest.approx(0, abs=1e-6)
+    assert np.allclose(rmsd[1:], [kabsch_rmsd(ref, mdl) for mdl in noisy])
+
+def test_load_store(outdir, monkeypatch):
+    '''The coordinates are read once and the store is rebuilt when a pdb file changes'''
+    files = sorted(os.path.join(outdir, ifile) for ifile in os.listdir(outdir))
+    coords, atoms = cluster_str.load_store(outdir, files)
+    assert coords.shape == (6, len(atoms), 3)
+    assert os.path.isfile(outdir + cluster_str.STORE_EXT)
+    names, first = cluster_str.read_atoms(files[0])
+    assert np.array_equal(coords[0], first)
+    def fail(*args):
+        raise AssertionError('the store should not be rebuilt')
+    with monkeypatch.context() as m:
+        m.setattr(cluster_str, 'build_store', fail)
+        cluster_str.load_store(outdir, files)
+    os.utime(files[0], ns=(0, 0))
+    coords, atoms = cluster_str.load_store(outdir, files, nproc=2)
+    assert np.array_equal(coords[0], first)
+
+def test_rmsd_matrix(outdir):
+    '''The RMSD matrix is symmetric and the same with worker processes'''
+    files = sorted(os.path.join(outdir, ifile) for ifile in os.listdir(outdir))
+    coords, atoms = cluster_str.load_store(outdir, files)
+    indices = cluster_str.atom_indices(atoms, ['CA'])
+    storefile = outdir + cluster_str.STORE_EXT
+    matrix = cluster_str.rmsd_matrix(storefile, indices, batch=2)
+    assert np.allclose(matrix, matrix.T)
+    assert (np.diag(matrix) == 0).all()
+    assert matrix[0, 1] == pytest.approx(kabsch_rmsd(np.asarray(coords[0, indices], float), np.asarray(coords[1, indices], float)), abs=1e-4)
+    assert np.allclose(cluster_str.rmsd_matrix(storefile, indices, nproc=2), matrix)
+    assert sorted(os.listdir(os.path.dirname(outdir))) == ['best', 'best' + cluster_str.STORE_INFO_EXT, 'best' + cluster_str.STORE_EXT]
+    centered = cluster_str.center_store(storefile, indices, batch=4)
+    assert np.allclose(centered, cluster_str.center(coords[:, indices]))
+    with pytest.raises(HMAnalysisError):
+        cluster_str.atom_indices(atoms, ['XX'])
+
+def test_cluster_rmsd():
+    '''The model with the most neighbours is the center of the first cluster'''
+    points = np.array([0.0, 0.5, 1.0, 1.4, 10.0, 10.5])
+    matrix = np.abs(points[:, None] - points[None, :])
+    labels, centers = cluster_str.cluster_rmsd(matrix, 0.6)
+    assert centers[0] == 1
+    assert labels.tolist() == [0, 0, 0, 2, 1, 1]
+
+def test_main(outdir, monkeypatch):
+    '''Test if main writes the cluster of each model and the RMSD matrix'''
+    monkeypatch.chdir(os.path.dirname(outdir))
+    monkeypatch.setattr(sys, 'argv', ['cluster_str', '-outdir', 'best', '-rootname', 'glyt1.B', '-cutoff', '1.0', '-ormsd', 'rmsd.npy'])
+    cluster_str.main()
+    clusters = np.loadtxt('clusters.txt', dtype=str, skiprows=1)
+    assert len(clusters) == 6
+    assert clusters[:, 2].astype(int).sum() == len(set(clusters[:, 1]))
+    assert np.load('rmsd.npy').shape == (6, 6)
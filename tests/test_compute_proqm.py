@@ -0,0 +1,173 @@
+from hm_analysis_tool import compute_proqm
+from hm_analysis_tool import profile_cache
+import pytest
+import os
+import sys
+import shutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FAKE_SCORE_APP = '''#!{python}
+import sys, os
+args = sys.argv[1:]
+scorefile = args[args.index('-out:file:scorefile') + 1]
+pdbs = []
+if '-in:file:s' in args:
+    pdbs.append(args[args.index('-in:file:s') + 1])
+if '-in:file:l' in args:
+    pdbs.extend(open(args[args.index('-in:file:l') + 1]).read().split())
+new = not os.path.isfile(scorefile)
+with open(scorefile, 'a') as f:
+    if new:
+        f.write('SEQUENCE:\\nSCORE: total_score ProQM description\\n')
+    for pdb in pdbs:
+        tag = os.path.basename(pdb).split('.pdb')[0]
+        f.write('SCORE: %.3f %.3f %s_0001\\n' % (len(pdb), len(pdb) / 100.0, tag))
+        open(tag + '.ProQM.local', 'w').write(pdb)
+'''
+
+@pytest.fixture
+def score_app(tmp_path):
+    '''Fake Rosetta score application that writes a score line and a local prediction per pdb'''
+    app = tmp_path / 'score.static'
+    app.write_text(FAKE_SCORE_APP.format(python=sys.executable))
+    app.chmod(0o755)
+    return str(app)
+
+@pytest.fixture
+def pdbs(tmp_path):
+    files = []
+    for i in range(1, 9):
+        pdb = tmp_path / ('glyt1.B9999%04d.pdbcl' % i)
+        pdb.write_text('ATOM\n')
+        files.append(str(pdb))
+    return files
+
+def test_schedule_proqm(tmp_path,monkeypatch,score_app,pdbs):
+    '''Test if the models scored in parallel are merged in one score file sorted by model'''
+    monkeypatch.chdir(tmp_path)
+    failed = compute_proqm.schedule_proqm(score_app,'db','glyt1.pdb',pdbs,'500',nproc=3)
+    assert failed == []
+    header, rows = compute_proqm.read_scorefile('ProQM.sc')
+    assert header.split()[-1] == 'description'
+    assert [row.split()[-1] for row in rows] == ['glyt1.B9999%04d_0001' % i for i in range(1, 9)]
+    assert os.path.isfile('glyt1.B99990008.ProQM.local')
+    assert not os.path.exists('proqm_workers')
+
+def test_schedule_proqm_rescore(tmp_path,monkeypatch,score_app,pdbs):
+    '''Test if the rows of models scored again replace their old rows'''
+    monkeypatch.chdir(tmp_path)
+    compute_proqm.schedule_proqm(score_app,'db','glyt1.pdb',pdbs[:2],'500')
+    compute_proqm.schedule_proqm(score_app,'db','glyt1.pdb',pdbs[1:3],'500')
+    header, rows = compute_proqm.read_scorefile('ProQM.sc')
+    assert header.split()[-1] == 'description'
+    assert [row.split()[-1] for row in rows] == ['glyt1.B9999%04d_0001' % i for i in range(1, 4)]
+
+def test_run_job_retries(tmp_path):
+    '''Test if a failing or timed out command is reported as failed'''
+    assert compute_proqm.run_job(['true'])
+    assert not compute_proqm.run_job(['false'],retries=2)
+    assert not compute_proqm.run_job(['sleep', '5'],timeout=0.1)
+
+def test_schedule_proqm_batch(tmp_path,monkeypatch,score_app,pdbs):
+    '''Test if scoring the models in batches gives the same score file as one model per process'''
+    monkeypatch.chdir(tmp_path)
+    compute_proqm.schedule_proqm(score_app,'db','glyt1.pdb',pdbs,'500',nproc=2)
+    os.rename('ProQM.sc', 'single.sc')
+    failed = compute_proqm.schedule_proqm(score_app,'db','glyt1.pdb',pdbs,'500',nproc=2,batch=3)
+    assert failed == []
+    assert compute_proqm.read_scorefile('ProQM.sc') == compute_proqm.read_scorefile('single.sc')
+
+def test_proqm_cmd_list():
+    '''Test if the list input option replaces the single pdb input'''
+    cmd = compute_proqm.proqm_cmd('score','db','glyt1.pdb','mdl.pdbcl','500',listfile='models.list')
+    assert cmd[cmd.index('-in:file:l') + 1] == 'models.list'
+    assert '-in:file:s' not in cmd
+    assert cmd[cmd.index('-ProQ:normalize') + 1] == '500'
+
+def test_print_clean_pdb(tmp_path):
+    '''Test if the patched terminal atoms are removed from the model'''
+    pdbin = 'test-case/glyt1/glyt1.B99990001.pdb'
+    pdbout = compute_proqm.print_clean_pdb(pdbin,str(tmp_path / 'glyt1.B99990001.pdbcl'))
+    with open(pdbin) as f:
+        check = [line for line in f if not any(atom in line for atom in compute_proqm.TERMINAL_ATOMS)]
+    with open(pdbout) as f:
+        assert f.readlines() == check
+
+def test_schedule_proqm_clean(tmp_path,monkeypatch,score_app,pdbs):
+    '''Test if the models cleaned inside the scoring jobs do not leave *.pdbcl files'''
+    monkeypatch.chdir(tmp_path)
+    models = []
+    for pdb in pdbs:
+        os.rename(pdb, pdb[:-2])
+        models.append(pdb[:-2])
+    failed = compute_proqm.schedule_proqm(score_app,'db','glyt1.pdb',models,'500',nproc=2,batch=2,clean=True)
+    assert failed == []
+    header, rows = compute_proqm.read_scorefile('ProQM.sc')
+    assert len(rows) == 8
+    assert not any(ifile.endswith('.pdbcl') for ifile in os.listdir(str(tmp_path)))
+
+def test_schedule_proqm_clean_missing(tmp_path,monkeypatch,score_app,pdbs):
+    '''Test if a model that cannot be cleaned fails its batch without blocking the worker'''
+    monkeypatch.chdir(tmp_path)
+    models = []
+    for pdb in pdbs:
+        os.rename(pdb, pdb[:-2])
+        models.append(pdb[:-2])
+    models.insert(1, str(tmp_path / 'missing.pdb'))
+    done = []
+    failed = compute_proqm.schedule_proqm(score_app,'db','glyt1.pdb',models,'500',nproc=1,clean=True,on_done=lambda chunk, ok: done.append((chunk, ok)))
+    assert failed == [models[1]]
+    assert ([models[1]], False) in done
+    header, rows = compute_proqm.read_scorefile('ProQM.sc')
+    assert len(rows) == 8
+    assert not any(ifile.endswith('.pdbcl') for ifile in os.listdir(str(tmp_path)))
+
+def test_cached_profile(tmp_path,monkeypatch):
+    '''Test if a profile is computed once and then restored from the cache for the same sequence'''
+    monkeypatch.chdir(tmp_path)
+    calls = []
+    def fake_profile(proqmdir,fpdb,fullseq):
+        calls.append(fpdb)
+        for ext in ['.span', '.psi']:
+            open(fpdb + ext, 'w').write('profile of ' + fpdb)
+    monkeypatch.setattr(compute_proqm, 'get_profile', fake_profile)
+    cache_root = str(tmp_path / 'cache')
+    for i in [1, 2]:
+        shutil.copy('%s/test-case/glyt1/glyt1.B9999000%d.pdb' % (ROOT, i), '.')
+    compute_proqm.cached_profile('bin','glyt1.B99990001.pdb','',cache_root)
+    compute_proqm.cached_profile('bin','glyt1.B99990002.pdb','',cache_root)
+    assert calls == ['glyt1.B99990001.pdb']
+    assert open('glyt1.B99990002.pdb.span').read() == 'profile of glyt1.B99990001.pdb'
+    profile_cache.cache_evict(cache_root,0)
+    assert os.listdir(cache_root) == []
+
+def test_main_resume(tmp_path,monkeypatch,score_app):
+    '''Test if a second run with the journal only scores the models that were not scored'''
+    tmpldir = tmp_path / 'templates'
+    tmpldir.mkdir()
+    shutil.copy(ROOT + '/test-case/glyt1/glyt1.B99990001.pdb', str(tmpldir / 'template-lig.pdb'))
+    for i in range(1, 4):
+        shutil.copy(ROOT + '/test-case/glyt1/glyt1.B9999000%d.pdb' % i, str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    def fake_profile(proqmdir,fpdb,fullseq):
+        open(str(fpdb) + '.span', 'w').write('span\n500 500\n')
+    monkeypatch.setattr(compute_proqm, 'get_profile', fake_profile)
+    scored = []
+    run_job = compute_proqm.run_job
+    def count_job(cmd,cwd=None,timeout=None,retries=0):
+        scored.append(cmd[cmd.index('-in:file:s') + 1])
+        return run_job(cmd,cwd,timeout,retries)
+    monkeypatch.setattr(compute_proqm, 'run_job', count_job)
+    argv = ['compute_proqm', '-tmpldir', str(tmpldir), '-alignment_pir', ROOT + '/test-case/glyt1/glyt1_on_4xp4_noloop.pir',
+            '-rosetta_score_app', score_app, '-no_profile_cache']
+    monkeypatch.setattr(sys, 'argv', argv)
+    monkeypatch.setattr(compute_proqm, 'compute_proqm', lambda *args: 0)
+    compute_proqm.main()
+    assert len(scored) == 3
+    os.utime('glyt1.B99990002.pdb', ns=(0, 0))
+    compute_proqm.main()
+    assert len(scored) == 4
+    assert scored[-1].endswith('glyt1.B99990002.pdbcl')
+    header, rows = compute_proqm.read_scorefile('ProQM.sc')
+    assert [row.split()[-1] for row in rows] == ['glyt1.B9999000%d_0001' % i for i in range(1, 4)]
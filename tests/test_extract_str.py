@@ -0,0 +1,50 @@
+from hm_analysis_tool import extract_str
+from hm_analysis_tool.errors import HMAnalysisError
+import pytest
+import filecmp
+import os
+import numpy as np
+import pandas as pd
+
+@pytest.mark.parametrize('link_mode', extract_str.LINK_MODES)
+def test_place_files(tmp_path,link_mode):
+    '''Test if the pdb files are placed in the outdir with every link mode'''
+    files = ['test-case/glyt1/glyt1.B9999%04d.pdb' % i for i in range(1, 6)]
+    modes = extract_str.place_files(files,str(tmp_path),link_mode,nproc=2)
+    assert len(modes) == 5
+    for f in files:
+        assert filecmp.cmp(f, str(tmp_path / os.path.basename(f)), shallow=False)
+
+@pytest.mark.parametrize('link_mode', ['copy', 'symlink'])
+def test_create_outdir_duplicated_names(tmp_path,monkeypatch,link_mode):
+    '''Test if models of different directories with the same file name raise an error before anything is placed'''
+    for run in ['run1', 'run2']:
+        (tmp_path / run).mkdir()
+        (tmp_path / run / 'glyt1.B99990001.pdb').write_text('ATOM\n')
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(HMAnalysisError):
+        extract_str.create_outdir('best',['run1/glyt1.B99990001.pdb', 'run2/glyt1.B99990001.pdb'],link_mode)
+    assert not os.path.exists('best')
+
+def test_select_best_perc():
+    '''Test if the partial selection gives the same models as sorting all the scores'''
+    scores = pd.DataFrame({'pdbname': ['mdl%d.pdb' % i for i in range(1000)],
+                           'molpdf': np.random.default_rng(0).uniform(2000, 3000, 1000)})
+    check = scores.sort_values('molpdf').head(50)
+    xtx = extract_str.select_best_perc(scores,5)
+    assert xtx['pdbname'].tolist() == check['pdbname'].tolist()
+    assert extract_str.select_best_perc(scores,100)['pdbname'].tolist() == scores.sort_values('molpdf')['pdbname'].tolist()
+
+def test_best_perc_and_threshold():
+    '''Test a compound query of the best percentage of models below a threshold'''
+    scores = pd.DataFrame({'pdbname': ['a.pdb', 'b.pdb', 'c.pdb', 'd.pdb'], 'molpdf': [2500.0, 2300.0, 2450.0, 2600.0]})
+    xtx = extract_str.select_underthres(extract_str.select_best_perc(scores,50),2400)
+    assert xtx['pdbname'].tolist() == ['b.pdb']
+
+def test_parser_percent_threshold():
+    '''Test if parser accepts percent and threshold together and requires one of them'''
+    args = extract_str.get_parser(['-scorefile', 'molpdf.txt', '-outdir', 'best5,best10', '-percent', '5,10', '-threshold', '2400'])
+    assert args.perc == '5,10'
+    assert args.thres == '2400'
+    with pytest.raises(SystemExit):
+        extract_str.get_parser(['-scorefile', 'molpdf.txt', '-outdir', 'best'])
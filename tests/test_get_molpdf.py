@@ -1,4 +1,8 @@
 from hm_analysis_tool import get_molpdf
+from hm_analysis_tool import score_io
+import sys
+import os
+import shutil
 import pytest
 import pandas as pd
 
@@ -33,3 +37,106 @@ def test_get_list_score(listfiles,pattern,col):
     assert match.equals(check)
 
 
+
+def test_get_score_parallel():
+    '''Test if getscore gives the same result scanning the files with several processes'''
+    listfiles = ['test-case/glyt1/glyt1.B9999%04d.pdb' % i for i in range(1, 21)]
+    serial = get_molpdf.getscore(listfiles,'MODELLER OBJECTIVE',5)
+    parallel = get_molpdf.getscore(listfiles,'MODELLER OBJECTIVE',5,nproc=4)
+    assert parallel.equals(serial)
+
+def test_update_index(tmp_path):
+    '''Test if the score index only rescans new files and drops the deleted ones'''
+    listfiles = ['test-case/glyt1/glyt1.B9999%04d.pdb' % i for i in range(1, 4)]
+    indexfile = str(tmp_path / 'molpdf.txt.idx')
+    index, nscanned = get_molpdf.update_index(get_molpdf.read_index(indexfile,'MODELLER OBJECTIVE',5),listfiles[:2],'MODELLER OBJECTIVE',5)
+    assert nscanned == 2
+    get_molpdf.write_index(indexfile,index,'MODELLER OBJECTIVE',5)
+    index, nscanned = get_molpdf.update_index(get_molpdf.read_index(indexfile,'MODELLER OBJECTIVE',5),listfiles[1:],'MODELLER OBJECTIVE',5)
+    assert nscanned == 1
+    scores = get_molpdf.index_scores(index)
+    assert scores.values.tolist() == get_molpdf.getscore(listfiles[1:],'MODELLER OBJECTIVE',5).values.tolist()
+
+def test_update_index_settings(tmp_path):
+    '''Test if the index is rescanned when the pattern or the column change'''
+    listfiles = ['test-case/glyt1/glyt1.B9999%04d.pdb' % i for i in range(1, 4)]
+    indexfile = str(tmp_path / 'molpdf.txt.idx')
+    index, nscanned = get_molpdf.update_index(get_molpdf.read_index(indexfile,'MODELLER OBJECTIVE',5),listfiles,'MODELLER OBJECTIVE',5)
+    get_molpdf.write_index(indexfile,index,'MODELLER OBJECTIVE',5)
+    assert len(get_molpdf.read_index(indexfile,'MODELLER OBJECTIVE',5)) == 3
+    index, nscanned = get_molpdf.update_index(get_molpdf.read_index(indexfile,'DOPE score',4),listfiles,'DOPE score',4)
+    assert nscanned == 3
+    assert get_molpdf.index_scores(index)['col2'].tolist() == get_molpdf.getscore(listfiles,'DOPE score',4)['col2'].tolist()
+    assert len(get_molpdf.read_index(indexfile,'MODELLER OBJECTIVE',4)) == 0
+
+def test_getremarks():
+    '''Test if all the REMARK 6 fields are read in one pass and typed'''
+    listfiles = ['test-case/glyt1/glyt1.B99990002.pdb', 'test-case/glyt1/glyt1.B99990001.pdb']
+    remarks = get_molpdf.getremarks(listfiles)
+    assert remarks['pdbname'].tolist() == sorted(listfiles)
+    assert remarks['MODELLER OBJECTIVE FUNCTION'].tolist() == ['2386.0759', '2607.5806']
+    assert remarks['SEQUENCE'].tolist() == ['glyt1', 'glyt1']
+    typed = get_molpdf.typed_remarks(remarks)
+    assert typed['MODELLER BEST TEMPLATE % SEQ ID'].dtype == float
+    assert get_molpdf.score_field(remarks,'MODELLER OBJECTIVE') == 'MODELLER OBJECTIVE FUNCTION'
+
+def test_missing_field(tmp_path):
+    '''Test if a pdb file without the score is recorded as missing'''
+    pdb = tmp_path / 'glyt1.B99990999.pdb'
+    pdb.write_text('REMARK   6 SEQUENCE: glyt1\nATOM\n')
+    remarks = get_molpdf.getremarks(['test-case/glyt1/glyt1.B99990001.pdb', str(pdb)])
+    assert get_molpdf.missing_field(remarks,'MODELLER OBJECTIVE FUNCTION') == [str(pdb)]
+
+def test_shard_files():
+    '''Test if the shards are a partition of the pdb files that does not depend on the directory order'''
+    listfiles = get_molpdf.get_listoffiles('test-case/glyt1','glyt1.B')
+    shards = [get_molpdf.get_listoffiles('test-case/glyt1','glyt1.B',(i, 4)) for i in range(1, 5)]
+    assert sorted(sum(shards, [])) == sorted(listfiles)
+    assert all(len(shard) > 0 for shard in shards)
+    assert list(get_molpdf.shard_files(reversed(listfiles),2,4)) == list(reversed(shards[1]))
+    assert get_molpdf.parse_shard('2/4') == (2, 4)
+    for shard in ('0/4', '5/4', '2'):
+        with pytest.raises(ValueError):
+            get_molpdf.parse_shard(shard)
+
+def test_natural_sort():
+    '''Test if the numbers of the names are sorted by value'''
+    df = pd.DataFrame({'pdbname': ['m.B100000000.pdb', 'm.B99990010.pdb', 'm.B99990002.pdb'], 'molpdf': [1.0, 2.0, 3.0]})
+    assert get_molpdf.natural_sort(df,'pdbname')['pdbname'].tolist() == ['m.B99990002.pdb', 'm.B99990010.pdb', 'm.B100000000.pdb']
+    df = pd.DataFrame({'pdbname': ['run10/m.B99990001.pdb', 'run2/m.B99990003.pdb', 'run10/m.B99990002.pdb', 'run1/m.B99990001.pdb'], 'molpdf': [1.0, 2.0, 3.0, 4.0]})
+    assert get_molpdf.natural_sort(df,'pdbname')['pdbname'].tolist() == ['run1/m.B99990001.pdb', 'run10/m.B99990001.pdb', 'run10/m.B99990002.pdb', 'run2/m.B99990003.pdb']
+
+def test_shard_merge(tmp_path,monkeypatch):
+    '''Test if merging the partial score files of the shards gives the score file of all the pdb files'''
+    for i in range(1, 4):
+        ext = '.npy' if i == 2 else '.txt'
+        monkeypatch.setattr(sys, 'argv', ['get_molpdf', '-pdbdir', 'test-case/glyt1', '-rootname', 'glyt1.B', '-shard', '%d/3' % i, '-o', str(tmp_path / ('part%d' % i)) + ext])
+        get_molpdf.main()
+    monkeypatch.setattr(sys, 'argv', ['get_molpdf', '-pdbdir', 'test-case/glyt1', '-rootname', 'glyt1.B', '-o', str(tmp_path / 'all.txt')])
+    get_molpdf.main()
+    monkeypatch.setattr(sys, 'argv', ['merge_molpdf', str(tmp_path / 'part1.txt'), str(tmp_path / 'part2.npy'), str(tmp_path / 'part3.txt'), '-o', str(tmp_path / 'merged.txt')])
+    get_molpdf.merge_main()
+    merged = score_io.read_scores(str(tmp_path / 'merged.txt'))
+    scores = score_io.read_scores(str(tmp_path / 'all.txt'))
+    assert merged['pdbname'].tolist() == scores['pdbname'].tolist()
+    assert (merged['molpdf'] == scores['molpdf']).all()
+
+def test_shard_merge_directories(tmp_path,monkeypatch):
+    '''Test if the merged text partials of several directories are the same file as the unsharded run'''
+    pdbdirs = []
+    for i, run in enumerate(['run1', 'run2', 'run10']):
+        (tmp_path / run).mkdir()
+        for j in range(i * 10 + 1, i * 10 + 11):
+            shutil.copy('test-case/glyt1/glyt1.B9999%04d.pdb' % j, str(tmp_path / run))
+        pdbdirs.append(str(tmp_path / run))
+    pdbdir = ','.join(pdbdirs)
+    for i in range(1, 4):
+        monkeypatch.setattr(sys, 'argv', ['get_molpdf', '-pdbdir', pdbdir, '-rootname', 'glyt1.B', '-shard', '%d/3' % i, '-o', str(tmp_path / ('part%d.txt' % i))])
+        get_molpdf.main()
+    monkeypatch.setattr(sys, 'argv', ['get_molpdf', '-pdbdir', pdbdir, '-rootname', 'glyt1.B', '-o', str(tmp_path / 'all.txt')])
+    get_molpdf.main()
+    monkeypatch.setattr(sys, 'argv', ['merge_molpdf'] + [str(tmp_path / ('part%d.txt' % i)) for i in range(1, 4)] + ['-o', str(tmp_path / 'merged.txt')])
+    get_molpdf.merge_main()
+    assert (tmp_path / 'merged.txt').read_text() == (tmp_path / 'all.txt').read_text()
+    names = [line.split()[0] for line in (tmp_path / 'all.txt').read_text().splitlines()]
+    assert [os.path.basename(name) for name in names] == ['glyt1.B9999%04d.pdb' % j for j in range(1, 31)]
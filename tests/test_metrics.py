@@ -0,0 +1,26 @@
+from hm_analysis_tool import metrics
+from hm_analysis_tool import get_molpdf
+import pytest
+import json
+
+def test_stage_and_subprocess():
+    '''Test if the stages and the subprocess runtimes are recorded in the summary'''
+    with metrics.stage('test_getscore'):
+        get_molpdf.getscore(['test-case/glyt1/glyt1.B99990001.pdb'],'MODELLER OBJECTIVE',5)
+    metrics.run_subprocess('true', ['true'])
+    data = metrics.summary('test')
+    stage = [entry for entry in data['stages'] if entry['name'] == 'test_getscore'][-1]
+    assert stage['files_read'] == 1
+    assert stage['wall_time'] >= 0
+    assert stage['peak_rss_mb'] > 0
+    assert data['subprocesses'][-1]['name'] == 'true'
+    assert data['subprocesses'][-1]['returncode'] == 0
+
+def test_report_json(tmp_path):
+    '''Test if the metrics are written to a json file'''
+    jsonfile = str(tmp_path / 'metrics.json')
+    metrics.report('test',jsonfile=jsonfile)
+    with open(jsonfile) as f:
+        data = json.load(f)
+    assert data['entry_point'] == 'test'
+    assert 'stages' in data and 'subprocesses' in data
@@ -0,0 +1,42 @@
+from hm_analysis_tool import pipeline
+from hm_analysis_tool import get_molpdf
+from hm_analysis_tool import extract_str
+from hm_analysis_tool import cluster_str
+from hm_analysis_tool.errors import HMAnalysisError
+import pytest
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_pipeline(tmp_path,monkeypatch):
+    '''Test if the pipeline scans, checks the convergence and extracts the best models in one process'''
+    monkeypatch.chdir(tmp_path)
+    hm = pipeline.Pipeline(ROOT + '/test-case/glyt1','glyt1.B',nproc=2)
+    scores = hm.scan()
+    assert len(scores) == 99
+    rmslist = hm.convergence([10])
+    assert len(rmslist[0]) == 90
+    selected = hm.select(perc=10,thres=2400)
+    assert (selected['molpdf'] < 2400).all()
+    models = hm.extract('best','symlink')
+    assert len(models) == len(selected)
+    assert all(os.path.isfile(model) for model in models)
+    assert os.path.isfile('best/log.txt')
+    labels, centers = hm.cluster(cutoff=1.0)
+    assert len(labels) == len(models)
+    assert os.path.isfile('best' + cluster_str.STORE_EXT)
+
+def test_pipeline_errors(tmp_path,monkeypatch):
+    '''Test if the stages raise an exception instead of exiting'''
+    monkeypatch.chdir(tmp_path)
+    hm = pipeline.Pipeline(ROOT + '/test-case/glyt1','glyt1.B')
+    with pytest.raises(HMAnalysisError):
+        hm.select(perc=10)
+    hm.scan()
+    with pytest.raises(HMAnalysisError):
+        hm.convergence([200])
+    with pytest.raises(HMAnalysisError):
+        get_molpdf.get_listoffiles(str(tmp_path),'glyt1.B')
+    os.mkdir('best')
+    with pytest.raises(HMAnalysisError):
+        extract_str.create_outdir('best',[])
@@ -0,0 +1,83 @@
+from hm_analysis_tool import proqm_local
+from hm_analysis_tool import compute_proqm
+from hm_analysis_tool.errors import HMAnalysisError
+import numpy as np
+import pytest
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PIR = os.path.join(ROOT, 'test-case', 'glyt1', 'glyt1_on_4xp4_noloop.pir')
+
+def test_read_pir():
+    '''The structure and sequence entries give the template and model rootnames'''
+    entries = compute_proqm.read_pir(PIR)
+    assert entries['structure'][0] == compute_proqm.rootnm_from_pir('structure', PIR)
+    assert entries['sequence'][0] == compute_proqm.rootnm_from_pir('sequence', PIR)
+    assert len(entries['structure'][1]) == len(entries['sequence'][1])
+    assert not entries['sequence'][1].endswith('*')
+
+def test_read_pir_structure_types(tmp_path):
+    '''structureX headers are read as the structure entry and a missing entry raises an error'''
+    pir = tmp_path / 'aln.pir'
+    pir.write_text('>P1;tmpl\nstructureX:tmpl:1:A:4:A::::\nAC-D*\n\n>P1;target\nsequence:target:::::::\nACED*\n')
+    entries = compute_proqm.read_pir(str(pir))
+    assert entries['structure'] == ('tmpl', 'AC-D')
+    assert entries['sequence'] == ('target', 'ACED')
+    pir.write_text('>P1;target\nsequence:target:::::::\nACED*\n')
+    with pytest.raises(HMAnalysisError):
+        compute_proqm.read_pir(str(pir))
+
+def test_alignment_map():
+    '''Target residues aligned to gaps map to -1, chain breaks are skipped'''
+    resmap, residues = proqm_local.alignment_map('AC-DE/F', 'A-GDEHF')
+    assert resmap.tolist() == [0, -1, 2, 3, 5]
+    assert ''.join(residues) == 'ACDEF'
+
+def test_read_local_prediction(tmp_path):
+    '''Local predictions are read per line or from a single line'''
+    (tmp_path / 'a.local').write_text('# res score\n1 A 0.5\n2 C 0.25\n')
+    (tmp_path / 'b.local').write_text('0.5 0.25 0.75\n')
+    assert proqm_local.read_local_prediction(str(tmp_path / 'a.local')).tolist() == [0.5, 0.25]
+    assert proqm_local.read_local_prediction(str(tmp_path / 'b.local')).tolist() == [0.5, 0.25, 0.75]
+
+def test_load_local_matrix_and_stats(tmp_path):
+    '''The memory-mapped matrix is padded with nan and the statistics match a per-residue loop'''
+    rng = np.random.default_rng(0)
+    scores = rng.random((20, 6))
+    files = []
+    for i, row in enumerate(scores):
+        ifile = tmp_path / ('mdl%02d.ProQM.local' % i)
+        ifile.write_text('\n'.join('%d %.6f' % (j + 1, value) for j, value in enumerate(row)))
+        files.append(str(ifile))
+    (tmp_path / 'short.local').write_text('1 0.1\n2 0.2\n')
+    mmapfile = str(tmp_path / 'local.npy')
+    matrix = proqm_local.load_local_matrix(files + [str(tmp_path / 'short.local')], mmapfile)
+    assert matrix.shape == (21, 6)
+    assert np.isnan(matrix[20, 2:]).all()
+    assert np.load(mmapfile, mmap_mode='r').shape == (21, 6)
+    template = np.array([0.5, 0.6, 0.7, 0.8])
+    resmap = np.array([0, -1, 1, 2, 3, -1])
+    stats = proqm_local.residue_stats(matrix[:20], template, resmap)
+    assert np.allclose(stats['mean'], scores.round(6).mean(axis=0))
+    assert np.allclose(stats['std'], scores.round(6).std(axis=0))
+    assert np.isnan(stats['template'][[1, 5]]).all()
+    assert np.allclose(stats['diff'][[0, 2]], stats['mean'][[0, 2]] - template[[0, 1]])
+
+def test_main(tmp_path, monkeypatch):
+    '''Report and figure are written from the template and model local predictions'''
+    entries = compute_proqm.read_pir(PIR)
+    ntemplate = len([aa for aa in entries['structure'][1] if aa not in proqm_local.NOT_RESIDUES])
+    ntarget = len([aa for aa in entries['sequence'][1] if aa not in proqm_local.NOT_RESIDUES])
+    (tmp_path / (entries['structure'][0] + '.pdbcl.ProQM.local')).write_text('\n'.join(['0.5'] * ntemplate))
+    for i in range(3):
+        (tmp_path / (entries['sequence'][0] + '.B9999000%d.pdbcl.ProQM.local' % i)).write_text('\n'.join(['0.7'] * ntarget))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['proqm_local', '-alignment_pir', PIR, '-ofig', 'local.pdf'])
+    proqm_local.main()
+    report = np.loadtxt('proqm_local.txt', usecols=(2, 3, 4, 5))
+    assert report.shape == (ntarget, 4)
+    assert np.allclose(report[:, 0], 0.7)
+    mapped = ~np.isnan(report[:, 2])
+    assert np.allclose(report[mapped, 3], 0.2)
+    assert os.path.isfile('local.pdf')
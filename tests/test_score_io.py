@@ -0,0 +1,60 @@
+from hm_analysis_tool import score_io
+from hm_analysis_tool import check_molpdf_conv
+from hm_analysis_tool import extract_str
+import pytest
+import pandas as pd
+import numpy as np
+import os
+
+@pytest.fixture
+def scores():
+    return pd.DataFrame({'pdbname':['glyt1.B99990001.pdb','glyt1.B99990002.pdb','glyt1.B99990003.pdb'],
+                      'molpdf':['2386.0759','2607.5806','2439.0212']})
+
+@pytest.mark.parametrize('ext', ['.txt', '.npy'])
+def test_write_read_scores(tmp_path,scores,ext):
+    '''Test if a score file is read back with the same values in text and binary format'''
+    scorefile = str(tmp_path / ('molpdf' + ext))
+    score_io.write_scores(scorefile,scores)
+    df = score_io.read_scores(scorefile)
+    assert df['pdbname'].tolist() == scores['pdbname'].tolist()
+    assert np.allclose(df['molpdf'], scores['molpdf'].astype(float))
+    assert np.allclose(check_molpdf_conv.col2list(scorefile,1), scores['molpdf'].astype(float))
+
+def test_write_scores_replace(tmp_path,scores,monkeypatch):
+    '''Test if an existing score file is replaced in one step, without temporary files left'''
+    scorefile = str(tmp_path / 'molpdf.txt')
+    score_io.write_scores(scorefile,scores)
+    replaced = []
+    os_replace = score_io.os.replace
+    def check_replace(src,dst):
+        #the old file is complete until the new one replaces it
+        assert score_io.read_scores(dst)['pdbname'].tolist() == scores['pdbname'].tolist()
+        replaced.append(dst)
+        os_replace(src,dst)
+    monkeypatch.setattr(score_io.os, 'replace', check_replace)
+    score_io.write_scores(scorefile,scores.head(2))
+    assert replaced == [scorefile]
+    assert len(score_io.read_scores(scorefile)) == 2
+    assert os.listdir(str(tmp_path)) == ['molpdf.txt']
+
+def test_binary_names(tmp_path,scores):
+    '''Test if the names are stored as bytes and read back as text, also with non-ASCII names and old unicode files'''
+    scorefile = str(tmp_path / 'molpdf.npy')
+    scores.loc[2, 'pdbname'] = 'modèles/glyt1.B99990003.pdb'
+    score_io.write_scores(scorefile,scores)
+    assert score_io.load_records(scorefile).dtype['pdbname'].kind == 'S'
+    assert score_io.read_scores(scorefile)['pdbname'].tolist() == scores['pdbname'].tolist()
+    old = np.empty(3, dtype=[('pdbname', 'U40'), ('molpdf', np.float64)])
+    old['pdbname'] = scores['pdbname']
+    old['molpdf'] = scores['molpdf'].astype(float)
+    np.save(scorefile, old)
+    assert score_io.read_scores(scorefile)['pdbname'].tolist() == scores['pdbname'].tolist()
+
+def test_binary_best_perc(tmp_path,scores):
+    '''Test if extract_str selects the same models from a binary score file'''
+    scorefile = str(tmp_path / 'molpdf.npy')
+    score_io.write_scores(scorefile,scores)
+    xtx_score, list_pdb = extract_str.get_best_perc(scorefile,50)
+    assert list_pdb == ['glyt1.B99990001.pdb','glyt1.B99990003.pdb']
+    assert xtx_score == [2439.0212]